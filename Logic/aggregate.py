@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+augmented subtree aggregates
+
+each node of an augmented tree carries, for every registered projection of the value,
+the projected number of its own value and the summaries of its two subtrees:
+    augment -> (own numbers, left summaries, right summaries)
+a summary is (count, total, minimum, maximum) of the numbers below a node, so an aggregate
+over a key range combines O(height) stored summaries instead of reading the values in it
+"""
+import pickle
+
+from exception import *
+
+EMPTY = (0, 0, None, None)
+OPS = ('count', 'sum', 'min', 'max', 'avg')
+
+
+def _merge(a, b):
+    if not a[0]:
+        return b
+    if not b[0]:
+        return a
+    return a[0] + b[0], a[1] + b[1], min(a[2], b[2]), max(a[3], b[3])
+
+
+def dump_augments(projections):
+    """
+    serialise [(name, projection)]; like index extractors, projections are pickled by reference,
+    so they must be module level functions importable by every process opening the file
+    :param projections:
+    :return:
+    """
+    try:
+        return pickle.dumps(projections)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise AggregateError("Aggregate projection must be a module level function: %s" % e)
+
+
+def load_augments(string):
+    return pickle.loads(string)
+
+
+class Augments(object):
+    """
+    the projections a tree is augmented with, in the order their summaries are stored in the nodes
+    """
+    def __init__(self, projections):
+        """
+        :param projections: [(name, projection)]; projection(value) returns a number, or None to leave
+            the value out
+        """
+        self.projections = list(projections)
+        self.names = [name for name, _ in self.projections]
+        self.empty = tuple(EMPTY for _ in self.projections)
+
+    def own(self, value):
+        return tuple(projection(value) for _, projection in self.projections)
+
+    def augment(self, value, left, right):
+        """
+        augment of a node holding value between subtrees summarised by left and right
+        :param value:
+        :param left:
+        :param right:
+        :return:
+        """
+        return self.own(value), left, right
+
+    def summary(self, augment):
+        """
+        summaries of the subtree of a node with the given augment, None for no node
+        :param augment:
+        :return:
+        """
+        if augment is None:
+            return self.empty
+        own, left, right = augment
+        return self.combine(left, self.point(own), right)
+
+    def point(self, own):
+        return tuple(EMPTY if number is None else (1, number, number, number) for number in own)
+
+    def combine(self, *summaries):
+        combined = self.empty
+        for summary in summaries:
+            combined = tuple(_merge(a, b) for a, b in zip(combined, summary))
+        return combined
+
+    def result(self, summaries, name, op):
+        """
+        the op of the named projection out of combined summaries
+        :param summaries:
+        :param name:
+        :param op: one of OPS
+        :return: None for min, max and avg over no numbers
+        """
+        count, total, minimum, maximum = summaries[self.names.index(name)]
+        if op == 'count':
+            return count
+        if op == 'sum':
+            return total
+        if op == 'min':
+            return minimum
+        if op == 'max':
+            return maximum
+        return total / float(count) if count else None
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+write-ahead delta log
+"""
+import pickle
+
+# marks a deleted key in a write set or in the delta index
+DELETED = object()
+
+
+def chain_addresses(storage, address):
+    """
+    addresses of the records of the chain starting at address, newest first
+    :param storage:
+    :param address:
+    :return:
+    """
+    addresses = []
+    while address:
+        addresses.append(address)
+        address = pickle.loads(storage.read(address))['prev']
+    return addresses
+
+
+class DeltaLog(object):
+    """
+    chain of delta records appended to the file, newest referenced from the superblock;
+    each record is the write set of one small commit:
+        record:
+            prev -> address of the previous record, 0 for the first
+            ops -> [(key, 'set', value string) or (key, 'delete', None)]
+    the chain is replayed into an in-memory index that reads overlay on the tree
+    """
+    def __init__(self, value_ref):
+        self.value_ref = value_ref
+        self.clear()
+
+    def clear(self):
+        self.address = 0
+        self.size = 0
+        self.index = {}
+
+    def load(self, storage, address):
+        """
+        bring the index up to the chain starting at address,
+        reading only the records appended since the last load
+        :param storage:
+        :param address:
+        :return:
+        """
+        if address == self.address:
+            return
+        head = address
+        records = []
+        while address and address != self.address:
+            data = storage.read(address)
+            record = pickle.loads(data)
+            records.append((record, len(data)))
+            address = record['prev']
+        if address != self.address:
+            # the chain we knew was folded into the tree, rebuild from scratch
+            self.clear()
+        for record, size in reversed(records):
+            self._apply(record, size)
+        self.address = head
+
+    def append(self, storage, ops):
+        """
+        write one record for the write set ops ({key: value or DELETED})
+        :param storage:
+        :param ops:
+        :return: address of the new record, to be committed as the chain head
+        """
+        value_ref = self.value_ref()
+        record = {'prev': self.address, 'ops': []}
+        for key in sorted(ops):
+            if ops[key] is DELETED:
+                record['ops'].append((key, 'delete', None))
+            else:
+                record['ops'].append((key, 'set', value_ref.refer_to_string(ops[key])))
+        data = pickle.dumps(record)
+        self.address = storage.write(data)
+        self._apply(record, len(data))
+        return self.address
+
+    def _apply(self, record, size):
+        value_ref = self.value_ref()
+        for key, op, string in record['ops']:
+            if op == 'delete':
+                self.index[key] = DELETED
+            else:
+                self.index[key] = value_ref.string_to_refer(string)
+        self.size += size
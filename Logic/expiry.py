@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+expiry index: keys with a ttl ordered by the time they expire
+"""
+import struct
+import time
+
+_EXPIRES = struct.Struct('>Q')
+
+
+def now():
+    """
+    current time as stored in node expiries, milliseconds since the epoch
+    :return:
+    """
+    return int(time.time() * 1000)
+
+
+def expiry_key(expires, key):
+    """
+    expiry index key, in the key type of the tree: a fixed width expiry time then the key,
+    so entries order by expiry first
+    :param expires:
+    :param key:
+    :return:
+    """
+    if isinstance(key, bytes):
+        return _EXPIRES.pack(expires) + key
+    return '%016x' % expires + key
+
+
+def split_expiry_key(entry):
+    if isinstance(entry, bytes):
+        return _EXPIRES.unpack(entry[:_EXPIRES.size])[0], entry[_EXPIRES.size:]
+    return int(entry[:16], 16), entry[16:]
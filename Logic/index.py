@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+secondary indexes
+"""
+import pickle
+
+from exception import *
+
+# separates the field value from the primary key in an index tree key;
+# sorts below every other character, so entries order by field value first
+SEPARATOR = '\x00'
+
+
+def index_key(field, primary_key):
+    return field + SEPARATOR + primary_key
+
+
+def split_index_key(key):
+    return tuple(key.split(SEPARATOR, 1))
+
+
+def dump_catalog(catalog):
+    """
+    serialise {name: (root_address, extractor)}; extractors are pickled by reference,
+    so they must be module level functions importable by every process opening the file
+    :param catalog:
+    :return:
+    """
+    try:
+        return pickle.dumps(catalog)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise SecondaryIndexError("Index extractor must be a module level function: %s" % e)
+
+
+def load_catalog(string):
+    return pickle.loads(string)
+
+
+class SecondaryIndex(object):
+    """
+    read view of one secondary index of a tree, mapping extracted field values to primary keys;
+    reflects committed data only, entries are maintained in commit()
+    """
+    def __init__(self, tree, name):
+        self._tree = tree
+        self.name = name
+
+    def range(self, start=None, stop=None):
+        """
+        (field value, primary key) pairs with start <= field value < stop, in order
+        :param start:
+        :param stop:
+        :return:
+        """
+        start_key = None if start is None else start + SEPARATOR
+        stop_key = None if stop is None else stop + SEPARATOR
+        for key in self._tree.index_keys(self.name, start_key, stop_key):
+            yield split_index_key(key)
+
+    def get(self, field):
+        """
+        primary keys whose field value equals field
+        :param field:
+        :return:
+        """
+        return [
+            split_index_key(key)[1]
+            for key in self._tree.index_keys(self.name, field + SEPARATOR, field + '\x01')
+        ]
+
+    def __iter__(self):
+        return self.range()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+key codecs: how user keys map to the keys stored and compared in the tree
+
+the binary codec encodes bytes, str, integers and flat tuples of these to bytes
+whose plain byte order is the order of the original keys:
+    bytes -> 0x01 + data with 0x00 escaped as 0x00 0xff + 0x00
+    str -> 0x02 + utf-8 data, escaped the same way + 0x00
+    int < 0 -> 0x14 + 8 bytes big endian of 2 ** 64 + int (down to -2 ** 63)
+    int >= 0 -> 0x15 + 8 bytes big endian (up to 2 ** 64 - 1)
+    tuple -> its elements' encodings concatenated
+so types order as bytes < str < negative int < non-negative int, and a tuple orders
+element by element; a 1-tuple encodes like its element and decodes to it
+"""
+import struct
+
+from exception import *
+
+BYTES_CODE = 0x01
+STRING_CODE = 0x02
+NEGATIVE_INT_CODE = 0x14
+INT_CODE = 0x15
+
+_UINT64 = struct.Struct('>Q')
+_BYTES_PREFIX = struct.pack('B', BYTES_CODE)
+_STRING_PREFIX = struct.pack('B', STRING_CODE)
+_NEGATIVE_INT_PREFIX = struct.pack('B', NEGATIVE_INT_CODE)
+_INT_PREFIX = struct.pack('B', INT_CODE)
+
+
+def _escape(data):
+    return data.replace(b'\x00', b'\x00\xff') + b'\x00'
+
+
+def _encode_element(element):
+    if isinstance(element, bytes):
+        return _BYTES_PREFIX + _escape(element)
+    if isinstance(element, str):
+        return _STRING_PREFIX + _escape(element.encode('utf-8'))
+    if isinstance(element, int) and not isinstance(element, bool):
+        if -(1 << 63) <= element < 0:
+            return _NEGATIVE_INT_PREFIX + _UINT64.pack((1 << 64) + element)
+        if 0 <= element < (1 << 64):
+            return _INT_PREFIX + _UINT64.pack(element)
+        raise KeyCodecError("Integer key %r out of range!" % (element, ))
+    raise KeyCodecError("Can not encode key element %r!" % (element, ))
+
+
+def encode_key(key):
+    if type(key) is int and 0 <= key < (1 << 64):
+        # the common case: a non-negative integer id
+        return _INT_PREFIX + _UINT64.pack(key)
+    if isinstance(key, tuple):
+        return b''.join(_encode_element(element) for element in key)
+    return _encode_element(key)
+
+
+def decode_key(data):
+    if len(data) == 9 and data[:1] == _INT_PREFIX:
+        return _UINT64.unpack(data[1:])[0]
+    elements = []
+    position = 0
+    while position < len(data):
+        code = bytearray(data[position:position + 1])[0]
+        position += 1
+        if code in (BYTES_CODE, STRING_CODE):
+            chunks = []
+            while True:
+                end = data.index(b'\x00', position)
+                chunks.append(data[position:end])
+                if data[end + 1:end + 2] == b'\xff':
+                    chunks.append(b'\x00')
+                    position = end + 2
+                else:
+                    position = end + 1
+                    break
+            element = b''.join(chunks)
+            elements.append(element if code == BYTES_CODE else element.decode('utf-8'))
+        elif code in (NEGATIVE_INT_CODE, INT_CODE):
+            value = _UINT64.unpack(data[position:position + 8])[0]
+            elements.append(value - (1 << 64) if code == NEGATIVE_INT_CODE else value)
+            position += 8
+        else:
+            raise KeyCodecError("Bad key type code %#x!" % code)
+    if len(elements) == 1:
+        return elements[0]
+    return tuple(elements)
+
+
+class StringKeyCodec(object):
+    """
+    keys are python strings, stored as they are
+    """
+    code = 0
+    key_type = str
+
+    @staticmethod
+    def encode(key):
+        return key
+
+    @staticmethod
+    def decode(key):
+        return key
+
+
+class BinaryKeyCodec(object):
+    """
+    keys are bytes, str, integers or tuples of these, stored as order-preserving bytes
+    """
+    code = 1
+    key_type = bytes
+
+    @staticmethod
+    def encode(key):
+        return encode_key(key)
+
+    @staticmethod
+    def decode(key):
+        return decode_key(key)
+
+
+KEY_CODECS = {
+    'str': StringKeyCodec,
+    'binary': BinaryKeyCodec,
+}
@@ -2,9 +2,40 @@
 """
 logical layer
 """
+import struct
+import threading
+from collections import OrderedDict, deque
+
 from physical import PhysicalObject
-from refer import ValueRef
-from tree import BinaryTree
+from Logic.refer import StringValueRef, VALUE_CODECS, node_ref_for
+from Logic.delta import DeltaLog, DELETED, chain_addresses
+from Logic.index import index_key, dump_catalog, load_catalog
+from Logic.keys import KEY_CODECS
+from Logic.expiry import now, expiry_key, split_expiry_key
+from Logic.aggregate import Augments, OPS, dump_augments, load_augments
+from exception import *
+
+_MISSING = object()
+# most nodes preloaded or saved as the hot set when there is no cache_limit
+HOT_SET_LIMIT = 1 << 16
+
+
+def _balanced_order(keys):
+    """
+    sorted keys reordered median first, level by level, so inserting them one by one
+    into the unbalanced tree doesn't degenerate into a list
+    :param keys:
+    :return:
+    """
+    keys = sorted(keys)
+    ranges = deque([(0, len(keys))])
+    while ranges:
+        low, high = ranges.popleft()
+        if low < high:
+            middle = (low + high) // 2
+            yield keys[middle]
+            ranges.append((low, middle))
+            ranges.append((middle + 1, high))
 
 
 class LogicalObject(object):
@@ -12,112 +43,1065 @@ class LogicalObject(object):
     implement API for  logical updates;
     """
     node_ref = None
-    value_ref = ValueRef
+    value_ref = StringValueRef
 
-    def __init__(self, physical_obj):
+    def __init__(self, physical_obj, cache_limit=None, delta_log=False, checkpoint_bytes=1 << 20,
+                 optimistic=False, key_codec=None, value_codec=None, preload=None, preload_background=False,
+                 readahead=0):
+        """
+        :param physical_obj:
+        :param cache_limit: max number of referents loaded from storage kept in memory, None for no limit
+        :param delta_log: commit write sets as delta records instead of path copies of the tree
+        :param checkpoint_bytes: fold the delta log into the tree once its records reach this size
+        :param optimistic: write without the lock, take it only in commit and rebase onto newer commits
+        :param key_codec: 'str' or 'binary' (see Logic.keys), recorded in the superblock;
+            None to use the one the file was created with
+        :param value_codec: one of Logic.refer.VALUE_CODECS ('utf8', 'bytes', 'marshal', 'json', 'pickle', 'array'),
+            recorded in the superblock; None to use the one the file was created with
+        :param preload: warm the node cache on open: a number of tree levels to load from the root,
+            or 'hot' for the nodes this handle had loaded when it was last closed (see save_hot_set)
+        :param preload_background: preload in a daemon thread, so opening doesn't wait for it
+        :param readahead: default nodes per batch read by ordered scans, 0 to read node by node
+        """
         assert isinstance(physical_obj, PhysicalObject)
         self._physical_obj = physical_obj
+        self._cache_limit = cache_limit
+        self._loaded = OrderedDict()  # id(ref) -> ref, least recently followed first
+        self._delta_log = delta_log
+        self._checkpoint_bytes = checkpoint_bytes
+        self._readahead = readahead
+        self._key_codec = self._choose_codec(KEY_CODECS, 'key_codec', key_codec, KeyCodecError)
+        self.value_ref = self._choose_codec(VALUE_CODECS, 'value_codec', value_codec, ValueCodecError)
+        self.node_ref = node_ref_for(self.value_ref)
+        self._deltas = DeltaLog(self.value_ref)
+        self._pending = {}  # uncommitted write set in delta_log mode
+        self._optimistic = optimistic
+        self._write_set = None  # optimistic transaction: {key: value or DELETED}
+        self._base = None  # optimistic transaction: (superblock, tree_ref, overlay) it started from
+        self._catalog_address = 0
+        self._catalog = {}  # committed secondary indexes: name -> (root address, extractor)
+        self._index_roots = (0, {})  # (catalog address, {name: root address}) as committed there
+        self._indexes = {}  # name -> index tree_ref
+        self._indexes_dirty = False
+        self._old_values = {}  # key -> value before this transaction, for index maintenance
+        self._expiry_ref = None  # expiry index tree: expiry_key(expires, key) entries
+        self._expiry_dirty = False
+        self._old_expiries = {}  # key -> expiry before this transaction, for expiry index maintenance
+        self._expiries = {}  # key -> expiry of the keys in the optimistic write set, for rebasing it
+        self._augment_address = 0
+        self._augments = None  # Logic.aggregate.Augments the tree nodes carry, None for none
+        self._augments_dirty = False
+        self._tree_ref = None
+        self._generation = None  # file generation the refs above belong to
+        self._refresh_tree_ref()
+        self._preload = preload
+        self._preload_thread = None
+        if preload is not None:
+            if preload == 'hot':
+                args = (None, self._read_hot_set())
+            else:
+                args = (preload, None)
+            if preload_background:
+                self._preload_thread = threading.Thread(target=self.preload, args=args)
+                self._preload_thread.daemon = True
+                self._preload_thread.start()
+            else:
+                self.preload(*args)
+
+    def _choose_codec(self, codecs, field, name, error):
+        """
+        the codec recorded in superblock field, or the named one for a database without data yet
+        :param codecs: name -> codec class with a `code`
+        :param field:
+        :param name:
+        :param error: exception class to raise on a mismatch
+        :return:
+        """
+        superblock = self._physical_obj.read_superblock()
+        has_data = superblock['root_address'] or superblock['delta_address']
+        recorded = [codec for codec in codecs.values() if codec.code == superblock[field]]
+        if not recorded:
+            raise error("Unknown %s %d in superblock!" % (field, superblock[field]))
+        if name is None:
+            return recorded[0]
+        if name not in codecs:
+            raise error("Unknown %s %r!" % (field, name))
+        if has_data and codecs[name] is not recorded[0]:
+            raise error("Database was written with another %s than %r!" % (field, name))
+        return codecs[name]
+
+    def codecs(self):
+        """
+        :return: (key codec, value ref class) this database stores with, see Logic.keys and Logic.refer
+        """
+        return self._key_codec, self.value_ref
+
+    def _codec_fields(self):
+        return {'key_codec': self._key_codec.code, 'value_codec': self.value_ref.code}
 
     def _refresh_tree_ref(self):
         """
         ensure reading up-to-data
         :return:
         """
-        self._tree_ref = self.node_ref(
-            address=self._physical_obj.get_root_address(),
-        )
+        superblock = self._physical_obj.read_superblock()
+        if self._generation != self._physical_obj.generation:
+            # the file was compacted: nothing loaded from the old one is valid
+            self._generation = self._physical_obj.generation
+            self._tree_ref = self._expiry_ref = None
+            self._deltas.clear()
+            self._catalog_address = self._augment_address = None
+            self._loaded.clear()
+        root_address = superblock['root_address']
+        # a stored ref never changes, so the nodes loaded under the current root stay valid
+        if self._tree_ref is None or not root_address or self._tree_ref.address != root_address:
+            self._tree_ref = self.node_ref(address=root_address)
+        expiry_address = superblock['expiry_address']
+        if self._expiry_ref is None or not expiry_address or self._expiry_ref.address != expiry_address:
+            self._expiry_ref = self.node_ref(address=expiry_address)
+        self._expiry_dirty = False
+        self._old_expiries = {}
+        self._expiries = {}
+        self._deltas.load(self._physical_obj, superblock['delta_address'])
+        self._pending = {}
+        self._load_catalog(superblock['index_address'])
+        self._load_augments(superblock['augment_address'])
 
-    def get(self, key):
-        if not self._physical_obj.locked:
+    def _in_transaction(self):
+        """
+        whether reads must keep seeing this handle's uncommitted state instead of refreshing
+        :return:
+        """
+        return self._physical_obj.locked or self._write_set is not None
+
+    def _begin_write(self):
+        """
+        take the lock, or when optimistic, snapshot the current state as the transaction base
+        :return:
+        """
+        if not self._optimistic:
+            self._lock_for_write()
+        elif self._write_set is None:
+            superblock = self._physical_obj.read_superblock()
             self._refresh_tree_ref()
-        return self._get(self._follow(self._tree_ref), key)
+            self._write_set = {}
+            self._base = (superblock, self._tree_ref, dict(self._deltas.index))
+            self._fold_deltas()
 
-    def set(self, key, value):
+    def _lock_for_write(self):
         if self._physical_obj.lock():
             self._refresh_tree_ref()
-        self._tree_ref = self._set(self._follow(self._tree_ref), key, self.value_ref(value))
+            self._fold_deltas()
+
+    def _fold_deltas(self):
+        """
+        outside delta_log mode, committed deltas are folded into the tree before writing,
+        so the path copies made from here on are the newest state
+        :return:
+        """
+        if not self._delta_log and self._deltas.index:
+            self._tree_ref = self._fold(self._tree_ref, self._deltas.index)
+            self._deltas.clear()
+
+    def get(self, key):
+        key = self._key_codec.encode(key)
+        if not self._in_transaction():
+            self._refresh_tree_ref()
+        try:
+            return self._lookup(key)
+        finally:
+            self._trim_cache()
+
+    def set(self, key, value, ttl=None):
+        """
+        :param key:
+        :param value:
+        :param ttl: seconds until the key expires, None for never; expired keys read as missing
+            and are deleted by purge_expired()
+        :return:
+        """
+        expires = 0
+        if ttl is not None:
+            if self._delta_log:
+                raise ExpiryError("Keys with a ttl can not be written in delta_log mode!")
+            expires = now() + max(int(ttl * 1000), 1)
+        self._write(self._key_codec.encode(key), value, expires)
+
+    def _write(self, key, value, expires=0):
+        value = self.value_ref.normalize(value)
+        self._begin_write()
+        self._capture_old_value(key)
+        if self._write_set is not None:
+            self._write_set[key] = value
+            if expires:
+                self._expiries[key] = expires
+            else:
+                self._expiries.pop(key, None)
+        if self._delta_log:
+            self._pending[key] = value
+            return
+        self._capture_old_expiry(key, expires)
+        self._tree_ref = self._set(self._follow(self._tree_ref), key, self.value_ref(value), expires, self._augments)
+        self._trim_cache()
 
     def delete(self, key):
+        key = self._key_codec.encode(key)
+        self._begin_write()
+        self._capture_old_value(key)
+        try:
+            if self._delta_log:
+                self._lookup(key)
+                self._pending[key] = DELETED
+            else:
+                self._capture_old_expiry(key, 0)
+                self._tree_ref = self._delete(self._follow(self._tree_ref), key, self._augments)
+            if self._write_set is not None:
+                self._write_set[key] = DELETED
+                self._expiries.pop(key, None)
+        finally:
+            self._trim_cache()
+
+    def update(self, pairs):
+        """
+        set many (key, value) pairs, inserted median first so sorted input keeps the tree shallow
+        :param pairs:
+        :return:
+        """
+        values = dict((self._key_codec.encode(key), value) for key, value in pairs)
+        for key in _balanced_order(values):
+            self._write(key, values[key])
+
+    def _lookup(self, key):
+        """
+        newest value of key: uncommitted write set, then delta log, then tree
+        :param key:
+        :return:
+        """
+        value = self._current_value(key)
+        if value is _MISSING or value is DELETED:
+            raise BinaryTreeKeyError("Node not exist!")
+        return value
+
+    def _current_value(self, key, include_expired=False):
+        value = self._pending.get(key, _MISSING)
+        if value is _MISSING:
+            value = self._read_at(self._tree_ref, self._deltas.index, key, include_expired)
+        return value
+
+    def _read_at(self, tree_ref, overlay, key, include_expired=False):
+        """
+        value of key in a tree with a delta overlay
+        :return: the value, DELETED or _MISSING
+        """
+        value = overlay.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        node = self._find_node(self._follow(tree_ref), key)
+        if node is None or (node.expires and not include_expired and node.expires <= now()):
+            return _MISSING
+        return self._follow(node.value_ref)
+
+    def _overlay(self):
+        if not self._pending:
+            return self._deltas.index
+        overlay = dict(self._deltas.index)
+        overlay.update(self._pending)
+        return overlay
+
+    def items(self, start=None, stop=None, root_address=None, delta_address=0, readahead=None):
+        """
+        iterate (key, value) pairs in key order, within [start, stop)
+        :param start:
+        :param stop:
+        :param root_address: read the tree committed at this address instead of the current one
+        :param delta_address: with root_address, the delta log head committed along with it
+        :param readahead: nodes per batch read, None for the handle's default
+        :return:
+        """
+        encode, decode = self._key_codec.encode, self._key_codec.decode
+        start = None if start is None else encode(start)
+        stop = None if stop is None else encode(stop)
+        if readahead is None:
+            readahead = self._readahead
+        for key, value in self._items(start, stop, root_address, delta_address, readahead):
+            yield decode(key), value
+
+    def _items(self, start, stop, root_address, delta_address, readahead=0):
+        if root_address is not None:
+            tree_ref = self.node_ref(address=root_address)
+            deltas = DeltaLog(self.value_ref)
+            deltas.load(self._physical_obj, delta_address)
+            overlay = deltas.index
+        else:
+            if not self._in_transaction():
+                self._refresh_tree_ref()
+            tree_ref = self._tree_ref
+            overlay = self._overlay()
+        overlay_keys = sorted(
+            key for key in overlay
+            if (start is None or key >= start) and (stop is None or key < stop)
+        )
+        i = 0
+        root = self._follow_ahead(tree_ref, start, stop, readahead)
+        for key, value_ref in self._iter(root, start, stop, now(), readahead):
+            while i < len(overlay_keys) and overlay_keys[i] < key:
+                if overlay[overlay_keys[i]] is not DELETED:
+                    yield overlay_keys[i], overlay[overlay_keys[i]]
+                i += 1
+            if i < len(overlay_keys) and overlay_keys[i] == key:
+                if overlay[key] is not DELETED:
+                    yield key, overlay[key]
+                i += 1
+            else:
+                yield key, self._follow(value_ref)
+            self._trim_cache()
+        for key in overlay_keys[i:]:
+            if overlay[key] is not DELETED:
+                yield key, overlay[key]
+
+    def version(self):
+        """
+        committed state as (root address, delta log address, compaction epoch), for diff and changes_since
+        :return:
+        """
+        superblock = self._physical_obj.read_superblock()
+        return superblock['root_address'], superblock['delta_address'], superblock['epoch']
+
+    def diff(self, old_version, new_version):
+        """
+        (key, 'added' | 'removed' | 'changed') between two committed versions, in key order;
+        costs about the size of the change, subtrees both versions share are never read
+        :param old_version: a version() tuple, or a bare root address
+        :param new_version: a version() tuple, or a bare root address
+        :return:
+        """
+        # checked now rather than on the first step of the walk
+        old_version, new_version = self._check_version(old_version), self._check_version(new_version)
+        decode = self._key_codec.decode
+        return ((decode(key), change) for key, change in self._diff_versions(old_version, new_version))
+
+    def _check_version(self, version):
+        """
+        version as a full version() tuple; a bare root address or a tuple without an epoch
+        is taken to be from before the first compaction
+        :param version:
+        :return:
+        """
+        if not isinstance(version, tuple):
+            version = (version, )
+        # fill in a missing delta log address and epoch
+        version += (0, 0)[len(version) - 1:]
+        epoch = self._physical_obj.read_superblock()['epoch']
+        if version[2] != epoch:
+            raise StaleVersionError(
+                "Version %r is from compaction epoch %d, the file is at %d: "
+                "compaction moved every record, take a new version" % (version, version[2], epoch)
+            )
+        return version
+
+    def _diff_versions(self, old_version, new_version):
+        old_ref, new_ref = self.node_ref(address=old_version[0]), self.node_ref(address=new_version[0])
+        old_deltas, new_deltas = DeltaLog(self.value_ref), DeltaLog(self.value_ref)
+        old_deltas.load(self._physical_obj, old_version[1])
+        new_deltas.load(self._physical_obj, new_version[1])
+
+        # keys in either delta log are compared on the full state instead of the trees
+        overlay_changes = []
+        for key in sorted(set(old_deltas.index) | set(new_deltas.index)):
+            old_value = self._read_at(old_ref, old_deltas.index, key)
+            new_value = self._read_at(new_ref, new_deltas.index, key)
+            old_exists = old_value is not _MISSING and old_value is not DELETED
+            new_exists = new_value is not _MISSING and new_value is not DELETED
+            if old_exists and not new_exists:
+                overlay_changes.append((key, 'removed'))
+            elif new_exists and not old_exists:
+                overlay_changes.append((key, 'added'))
+            elif old_exists and old_value != new_value:
+                overlay_changes.append((key, 'changed'))
+        overlay_keys = set(old_deltas.index) | set(new_deltas.index)
+
+        i = 0
+        for key, change in self._diff(old_ref, new_ref):
+            while i < len(overlay_changes) and overlay_changes[i][0] < key:
+                yield overlay_changes[i]
+                i += 1
+            if key not in overlay_keys:
+                yield key, change
+        for change in overlay_changes[i:]:
+            yield change
+
+    def changes_since(self, version):
+        """
+        changes from version to the current committed version
+        :param version:
+        :return:
+        """
+        return self.diff(version, self.version())
+
+    def split_keys(self, parts, root_address=None):
+        """
+        keys dividing the tree into `parts` ranges of (nearly) equal size
+        :param parts:
+        :param root_address:
+        :return: sorted list of at most parts - 1 keys
+        """
+        if root_address is not None:
+            root = self._follow(self.node_ref(address=root_address))
+        else:
+            if not self._in_transaction():
+                self._refresh_tree_ref()
+            root = self._follow(self._tree_ref)
+        if root is None:
+            return []
+        ranks = sorted(set(i * root.length // parts for i in range(1, parts)))
+        return [self._key_codec.decode(self._key_at(root, rank)) for rank in ranks if rank > 0]
+
+    def commit(self):
+        if self._write_set is not None:
+            self._commit_optimistic()
+            return
+        if self._delta_log:
+            # a commit with nothing pending may not hold the lock yet: refresh so it commits from the newest root
+            self._lock_for_write()
+            start = self._commit_start()
+            fields = self._commit_indexes()
+            fields.update(self._commit_expiries())
+            fields.update(self._commit_augments())
+            fields.update(self._codec_fields())
+            if self._pending:
+                fields['delta_address'] = self._deltas.append(self._physical_obj, self._pending)
+                self._pending = {}
+            # create_aggregate() may have rebuilt the tree
+            self._tree_ref.store(self._physical_obj)
+            fields['root_address'] = self._tree_ref.address
+            fields.update(self._space_fields(start, fields))
+            self._physical_obj.commit_root_address(**fields)
+            self._trim_cache()
+            if self._deltas.size >= self._checkpoint_bytes:
+                self.checkpoint()
+            return
+        self._lock_for_write()
+        start = self._commit_start()
+        fields = self._commit_indexes()
+        fields.update(self._commit_expiries())
+        fields.update(self._commit_augments())
+        fields.update(self._codec_fields())
+        self._tree_ref.store(self._physical_obj)
+        fields.update(root_address=self._tree_ref.address, delta_address=0)
+        fields.update(self._space_fields(start, fields))
+        self._physical_obj.commit_root_address(**fields)
+        self._after_commit()
+
+    def _commit_optimistic(self):
+        """
+        take the lock only now; if another writer committed since this transaction began,
+        replay the write set onto its state, unless one of our keys changed meanwhile
+        :return:
+        """
+        write_set = self._write_set
+        self._physical_obj.lock()
+        try:
+            if self._physical_obj.generation != self._generation:
+                raise TransactionConflictError("Database was compacted during the transaction!")
+            superblock = self._physical_obj.read_superblock()
+            base_superblock, base_tree_ref, base_overlay = self._base
+            if superblock != base_superblock:
+                old_values, old_expiries, expiries = self._old_values, self._old_expiries, self._expiries
+                self._refresh_tree_ref()
+                self._old_values, self._old_expiries, self._expiries = old_values, old_expiries, expiries
+                for key in write_set:
+                    before = self._read_at(base_tree_ref, base_overlay, key)
+                    current = self._read_at(self._tree_ref, self._deltas.index, key)
+                    if before is DELETED:
+                        before = _MISSING
+                    if current is DELETED:
+                        current = _MISSING
+                    if before is not current and before != current:
+                        raise TransactionConflictError("Key %r changed by another commit!" % (key, ))
+                self._fold_deltas()
+                if self._delta_log:
+                    self._pending = dict(write_set)
+                else:
+                    self._tree_ref = self._fold(self._tree_ref, write_set, expiries)
+            self._write_set = None
+            self._base = None
+            self.commit()
+        except Exception:
+            self._write_set = None
+            self._base = None
+            self._physical_obj.unlock()
+            self._refresh_tree_ref()
+            raise
+
+    def checkpoint(self):
+        """
+        fold the delta log and any uncommitted write set into the tree and commit it
+        :return:
+        """
         if self._physical_obj.lock():
             self._refresh_tree_ref()
-        self._tree_ref = self._delete(self._follow(self._tree_ref), key)
+        start = self._commit_start()
+        fields = self._commit_indexes()
+        fields.update(self._commit_expiries())
+        fields.update(self._commit_augments())
+        fields.update(self._codec_fields())
+        self._tree_ref = self._fold(self._tree_ref, self._overlay())
+        self._tree_ref.store(self._physical_obj)
+        fields.update(root_address=self._tree_ref.address, delta_address=0)
+        fields.update(self._space_fields(start, fields))
+        self._physical_obj.commit_root_address(**fields)
+        self._deltas.clear()
+        self._pending = {}
+        self._after_commit()
 
+    def _commit_start(self):
+        """
+        take the lock and note what the commit starts from, before it writes anything
+        :return: (committed superblock, file size, {index name: committed root address})
+        """
+        self._physical_obj.lock()
+        if self._physical_obj.generation != self._generation:
+            # the refs of this handle point into the file compaction replaced
+            self._physical_obj.unlock()
+            raise TransactionConflictError("Database was compacted during the transaction!")
+        superblock = self._physical_obj.read_superblock()
+        catalog_address, index_roots = self._index_roots
+        if catalog_address != superblock['index_address']:
+            catalog = load_catalog(self._physical_obj.read(superblock['index_address'])) \
+                if superblock['index_address'] else {}
+            index_roots = dict((name, entry[0]) for name, entry in catalog.items())
+        return superblock, self._physical_obj.size(), index_roots
 
-    def _follow(self, ref):
+    def _space_fields(self, start, fields):
         """
-        node_ref to node
-        :param ref:
+        running live/dead byte totals: the records a commit writes are live, and so are the ones it
+        still reaches; the replaced path copies, values, catalog and folded delta records become dead
+        :param start: _commit_start() of this commit
+        :param fields: superblock fields being committed
+        :return: superblock fields to commit along
+        """
+        base, boundary, index_roots = start
+        new = dict(base, **fields)
+        dead = self._unreachable(base['root_address'], self._tree_ref, boundary)
+        for name, root_address in index_roots.items():
+            dead.extend(self._unreachable(root_address, self._indexes.get(name, self.node_ref()), boundary))
+        dead.extend(self._unreachable(base['expiry_address'], self._expiry_ref, boundary))
+        for field in ('index_address', 'hot_address', 'augment_address'):
+            if base[field] and new[field] != base[field]:
+                dead.append(base[field])
+        if base['delta_address'] and not new['delta_address']:
+            dead.extend(chain_addresses(self._physical_obj, base['delta_address']))
+        return self._space_totals(base, boundary, self._physical_obj.record_sizes(set(dead)))
+
+    def _space_totals(self, base, boundary, dead_bytes):
+        live_bytes, total_dead = base['live_bytes'], base['dead_bytes']
+        if not live_bytes and not total_dead:
+            # file written before space was accounted: count everything in it as live
+            live_bytes = boundary - PhysicalObject.SUPERBLOCK_SIZE
+        appended = self._physical_obj.size() - boundary
+        return {'live_bytes': live_bytes + appended - dead_bytes, 'dead_bytes': total_dead + dead_bytes}
+
+    def space(self):
+        """
+        committed space accounting, kept up to date by every commit
+        :return: {'file_bytes', 'live_bytes', 'dead_bytes'}; dead bytes are reclaimed by compaction
+        """
+        superblock = self._physical_obj.read_superblock()
+        return {
+            'file_bytes': self._physical_obj.size(),
+            'live_bytes': superblock['live_bytes'],
+            'dead_bytes': superblock['dead_bytes'],
+        }
+
+    def _after_commit(self):
+        if self._cache_limit is not None:
+            # the written tree is reachable again through its address
+            self._tree_ref = self.node_ref(address=self._tree_ref.address)
+            for name, ref in self._indexes.items():
+                self._indexes[name] = self.node_ref(address=ref.address)
+            self._expiry_ref = self.node_ref(address=self._expiry_ref.address)
+        # space accounting walked the replaced part of the old tree
+        self._trim_cache()
+
+    def create_index(self, name, extractor):
+        """
+        add a secondary index mapping extractor(value) to primary keys and backfill it from
+        the current data; takes the write lock, persisted by the next commit
+        :param name:
+        :param extractor: module level function returning a string field value, or None to skip the value
         :return:
         """
-        return ref.get(self._physical_obj)
+        if self._write_set is not None:
+            raise SecondaryIndexError("Can not create an index inside an optimistic transaction!")
+        if self._key_codec.key_type is not str:
+            raise SecondaryIndexError("Secondary indexes need string keys!")
+        dump_catalog({name: (0, extractor)})
+        self._lock_for_write()
+        if name in self._indexes:
+            raise SecondaryIndexError("Index %r already exists!" % (name, ))
+        entries = []
+        for key, value in self.items():
+            field = extractor(value)
+            if field is not None:
+                entries.append((index_key(field, key), StringValueRef()))
+        entries.sort(key=lambda entry: entry[0])
+        self._indexes[name] = self._build(entries)
+        self._catalog[name] = (0, extractor)
+        self._indexes_dirty = True
 
-    def __len__(self):
-        if not self._physical_obj.locked:
+    def drop_index(self, name):
+        self._lock_for_write()
+        if name not in self._indexes:
+            raise SecondaryIndexError("Index %r not exist!" % (name, ))
+        del self._indexes[name]
+        del self._catalog[name]
+        self._indexes_dirty = True
+
+    def index_names(self):
+        if not self._in_transaction():
+            self._refresh_tree_ref()
+        return sorted(self._indexes)
+
+    def index_keys(self, name, start=None, stop=None):
+        """
+        keys of the index tree within [start, stop)
+        :param name:
+        :param start:
+        :param stop:
+        :return:
+        """
+        if not self._in_transaction():
             self._refresh_tree_ref()
+        if name not in self._indexes:
+            raise SecondaryIndexError("Index %r not exist!" % (name, ))
+        for key, _ in self._iter(self._follow(self._indexes[name]), start, stop):
+            yield key
+
+    def _load_catalog(self, address):
+        if address != self._catalog_address:
+            self._catalog = load_catalog(self._physical_obj.read(address)) if address else {}
+            self._catalog_address = address
+        self._indexes = dict(
+            (name, self.node_ref(address=root_address))
+            for name, (root_address, _) in self._catalog.items()
+        )
+        self._index_roots = (address, dict((name, entry[0]) for name, entry in self._catalog.items()))
+        self._indexes_dirty = False
+        self._old_values = {}
+
+    def _capture_old_value(self, key):
+        if self._indexes and key not in self._old_values:
+            self._old_values[key] = self._current_value(key, include_expired=True)
+
+    def _commit_indexes(self):
+        """
+        move the index entries of every key written in this transaction, then store the index trees;
+        called under the lock right before the superblock is written
+        :return: superblock fields to commit along with the tree
+        """
+        for key in _balanced_order(self._old_values):
+            old_value = self._old_values[key]
+            new_value = self._current_value(key, include_expired=True)
+            for name, ref in list(self._indexes.items()):
+                extractor = self._catalog[name][1]
+                old_field = None if old_value is _MISSING or old_value is DELETED else extractor(old_value)
+                new_field = None if new_value is _MISSING or new_value is DELETED else extractor(new_value)
+                if old_field == new_field:
+                    continue
+                if old_field is not None:
+                    try:
+                        ref = self._delete(self._follow(ref), index_key(old_field, key))
+                    except KeyError:
+                        pass
+                if new_field is not None:
+                    ref = self._set(self._follow(ref), index_key(new_field, key), StringValueRef())
+                self._indexes[name] = ref
+                self._indexes_dirty = True
+        self._old_values = {}
+        if not self._indexes_dirty:
+            return {}
+        for name, ref in self._indexes.items():
+            ref.store(self._physical_obj)
+            self._catalog[name] = (ref.address, self._catalog[name][1])
+        self._catalog_address = self._physical_obj.write(dump_catalog(self._catalog)) if self._catalog else 0
+        self._indexes_dirty = False
+        return {'index_address': self._catalog_address}
+
+    def create_aggregate(self, name, projection):
+        """
+        augment every tree node with the count, sum, min and max of projection(value) over its subtree,
+        for aggregate(); rewrites the whole tree once, later writes keep the summaries up to date on their
+        path copies. Takes the write lock, persisted by the next commit
+        :param name:
+        :param projection: module level function returning a number, or None to leave the value out
+        :return:
+        """
+        if self._write_set is not None:
+            raise AggregateError("Can not create an aggregate inside an optimistic transaction!")
+        dump_augments([(name, projection)])
+        self._lock_for_write()
+        projections = self._augments.projections if self._augments else []
+        if name in dict(projections):
+            raise AggregateError("Aggregate %r already exists!" % (name, ))
+        self._set_augments(projections + [(name, projection)])
+
+    def drop_aggregate(self, name):
+        if self._write_set is not None:
+            raise AggregateError("Can not drop an aggregate inside an optimistic transaction!")
+        self._lock_for_write()
+        if name not in self.aggregate_names():
+            raise AggregateError("Aggregate %r not exist!" % (name, ))
+        self._set_augments([entry for entry in self._augments.projections if entry[0] != name])
+
+    def _set_augments(self, projections):
+        augments = Augments(projections) if projections else None
+        self._tree_ref = self._augmented(self._tree_ref, augments)
+        self._augments = augments
+        self._augments_dirty = True
+        self._trim_cache()
+
+    def aggregate_names(self):
+        if not self._in_transaction():
+            self._refresh_tree_ref()
+        return list(self._augments.names) if self._augments else []
+
+    def aggregate(self, start=None, stop=None, op='sum', name=None):
+        """
+        op over the projected values of the keys within [start, stop), from the subtree summaries
+        along the two boundary paths; keys written since the last checkpoint or expired are looked up
+        one by one, everything else costs O(tree height)
+        :param start:
+        :param stop:
+        :param op: 'count', 'sum', 'min', 'max' or 'avg'
+        :param name: the aggregate, may be left out when there is only one
+        :return: None for min, max and avg over no values
+        """
+        if op not in OPS:
+            raise AggregateError("Unknown aggregate op %r!" % (op, ))
+        if not self._in_transaction():
+            self._refresh_tree_ref()
+        names = self._augments.names if self._augments else []
+        if name is None and len(names) == 1:
+            name = names[0]
+        if name not in names:
+            raise AggregateError("Aggregate %r not exist!" % (name, ))
+        start = None if start is None else self._key_codec.encode(start)
+        stop = None if stop is None else self._key_codec.encode(stop)
+        augments = self._augments
         root = self._follow(self._tree_ref)
-        if root:
-            return root.length
-        else:
-            return 0
+        overlay = dict((key, DELETED) for key in self._expired_keys(root, start, stop))
+        overlay.update(self._overlay())
+        keys = sorted(
+            key for key in overlay
+            if (start is None or key >= start) and (stop is None or key < stop)
+        )
+        # the tree is summarised between the overlay keys, the overlay values are added one by one
+        summaries = []
+        for key in keys:
+            summaries.append(self._range_summary(root, start, key, augments))
+            if overlay[key] is not DELETED:
+                summaries.append(augments.point(augments.own(overlay[key])))
+            # the smallest key after key
+            start = key + (b'\x00' if isinstance(key, bytes) else '\x00')
+        summaries.append(self._range_summary(root, start, stop, augments))
+        self._trim_cache()
+        return augments.result(augments.combine(*summaries), name, op)
 
+    def _expired_keys(self, root, start, stop):
+        """
+        keys within [start, stop) whose ttl has run out but which are still in the tree: the ones
+        the expiry index lists as expired, and the ones written since it was committed
+        :param root:
+        :param start:
+        :param stop:
+        :return:
+        """
+        moment = now()
+        stop_entry = expiry_key(moment + 1, self._key_codec.key_type())
+        keys = set(self._old_expiries)
+        for entry, _ in self._iter(self._follow(self._expiry_ref), None, stop_entry):
+            keys.add(split_expiry_key(entry)[1])
+        expired = []
+        for key in keys:
+            if (start is None or key >= start) and (stop is None or key < stop):
+                node = self._find_node(root, key)
+                if node is not None and node.expires and node.expires <= moment:
+                    expired.append(key)
+        return expired
 
-class DBDB(object):
-    """
-    implement the python dictionary API using concrete BinaryTree implementation
-    """
-    def __init__(self, f):
-        self._storage = PhysicalObject(f)
-        # Data stores tend to use more complex types of search trees such as
-        # B-trees, B+ trees, and others to improve the performance.
-        self._tree = BinaryTree(self._storage)
+    def _load_augments(self, address):
+        if address != self._augment_address:
+            self._augments = None
+            if address:
+                self._augments = Augments(load_augments(self._physical_obj.read(address)))
+            self._augment_address = address
+        self._augments_dirty = False
 
-    def _assert_not_closed(self):
-        if self._storage.closed:
-            raise ValueError('Database closed!')
+    def _commit_augments(self):
+        """
+        store the projections if create_aggregate() or drop_aggregate() changed them
+        :return: superblock fields to commit along with the tree
+        """
+        if not self._augments_dirty:
+            return {}
+        self._augment_address = self._physical_obj.write(dump_augments(self._augments.projections)) \
+            if self._augments else 0
+        self._augments_dirty = False
+        return {'augment_address': self._augment_address}
 
-    def commit(self):
-        self._assert_not_closed()
-        self._tree.commit()
+    def purge_expired(self):
+        """
+        delete the keys whose ttl has run out, found through the expiry index,
+        so only expired keys are touched; takes the write lock, persisted by the next commit
+        :return: number of keys deleted
+        """
+        self._begin_write()
+        stop = expiry_key(now() + 1, self._key_codec.key_type())
+        entries = [entry for entry, _ in self._iter(self._follow(self._expiry_ref), None, stop)]
+        purged = 0
+        for entry in entries:
+            expires, key = split_expiry_key(entry)
+            node = self._find_node(self._follow(self._tree_ref), key)
+            # the entry is stale if the key was deleted or written again since
+            stale = node is None or node.expires != expires or key in self._overlay()
+            if stale or self._delta_log:
+                self._expiry_ref = self._delete(self._follow(self._expiry_ref), entry)
+                self._expiry_dirty = True
+            if stale:
+                continue
+            self._capture_old_value(key)
+            if self._delta_log:
+                self._pending[key] = DELETED
+            else:
+                # the entry goes in commit, along with the key
+                self._capture_old_expiry(key, 0)
+                self._tree_ref = self._delete(self._follow(self._tree_ref), key, self._augments)
+            if self._write_set is not None:
+                self._write_set[key] = DELETED
+                self._expiries.pop(key, None)
+            purged += 1
+        self._trim_cache()
+        return purged
 
-    def close(self):
-        self._storage.close()
+    def _capture_old_expiry(self, key, expires):
+        if key in self._old_expiries or not (expires or self._follow(self._expiry_ref) is not None):
+            return
+        node = self._find_node(self._follow(self._tree_ref), key)
+        self._old_expiries[key] = node.expires if node is not None else 0
 
-    def __getitem__(self, key):
-        self._assert_not_closed()
-        return self._tree.get(key)
+    def _commit_expiries(self):
+        """
+        move the expiry index entries of the keys written in this transaction, then store the index;
+        called under the lock right before the superblock is written
+        :return: superblock fields to commit along with the tree
+        """
+        for key in _balanced_order(self._old_expiries):
+            old_expires = self._old_expiries[key]
+            node = self._find_node(self._follow(self._tree_ref), key)
+            new_expires = node.expires if node is not None else 0
+            if old_expires == new_expires:
+                continue
+            if old_expires:
+                try:
+                    self._expiry_ref = self._delete(self._follow(self._expiry_ref), expiry_key(old_expires, key))
+                except KeyError:
+                    pass
+            if new_expires:
+                self._expiry_ref = self._set(
+                    self._follow(self._expiry_ref), expiry_key(new_expires, key), StringValueRef()
+                )
+            self._expiry_dirty = True
+        self._old_expiries = {}
+        if not self._expiry_dirty:
+            return {}
+        self._expiry_ref.store(self._physical_obj)
+        self._expiry_dirty = False
+        return {'expiry_address': self._expiry_ref.address}
 
-    def __setitem__(self, key, value):
-        self._assert_not_closed()
-        return self._tree.set(key, value)
+    def _fold(self, tree_ref, ops, expiries=None):
+        """
+        apply a write set ({key: value or DELETED}) to the tree by path copying
+        :param tree_ref:
+        :param ops:
+        :param expiries: {key: expiry} of the keys set with a ttl
+        :return: the new tree ref
+        """
+        for key in _balanced_order(ops):
+            if ops[key] is DELETED:
+                try:
+                    tree_ref = self._delete(self._follow(tree_ref), key, self._augments)
+                except KeyError:
+                    pass
+            else:
+                tree_ref = self._set(
+                    self._follow(tree_ref), key, self.value_ref(ops[key]), expiries.get(key, 0) if expiries else 0,
+                    self._augments,
+                )
+        return tree_ref
 
-    def __delitem__(self, key):
-        self._assert_not_closed()
-        return self._tree.delete(key)
+    def preload(self, levels=None, addresses=None):
+        """
+        load the upper part of the committed tree ahead of lookups: its top levels, or the nodes
+        at addresses reachable from the root; records are read in file order, one pass per level,
+        or a single pass for addresses. Only positional reads, so it may run beside other operations
+        :param levels: number of levels, None for no limit
+        :param addresses: node addresses, e.g. the saved hot set
+        :return: number of nodes loaded
+        """
+        limit = HOT_SET_LIMIT if self._cache_limit is None else self._cache_limit
+        storage = self._physical_obj
+        records = storage.read_records(addresses) if addresses is not None else None
+        level = [self._tree_ref]
+        depth = count = 0
+        while level and count < limit and (levels is None or depth < levels):
+            if addresses is None:
+                records = storage.read_records(ref.address for ref in level if ref.address)
+            next_level = []
+            for ref in level:
+                if ref.address not in records or count >= limit:
+                    continue
+                node = ref.load(records[ref.address])
+                count += 1
+                next_level.extend(self._child_refs(node))
+            level = next_level
+            depth += 1
+        return count
 
-    def __contains__(self, key):
-        try:
-            self[key]
-        except KeyError:
-            return False
-        else:
-            return True
+    def _follow_ahead(self, ref, start, stop, readahead):
+        """
+        _follow for ordered scans: an unread subtree is first loaded readahead nodes at a time
+        :param ref:
+        :param start:
+        :param stop:
+        :param readahead:
+        :return:
+        """
+        if readahead and ref.address and ref.reference is None:
+            self._read_ahead(ref, start, stop, readahead)
+        return self._follow(ref)
 
-    def __len__(self):
-        return len(self._tree)
+    def _read_ahead(self, ref, start, stop, budget):
+        """
+        load up to budget nodes of the subtree at ref within [start, stop), top levels first, and
+        their values; one read_records pass in file order per level and one for the values.
+        The subtrees left unread are hinted to the kernel, so they come in while this batch is walked
+        :param ref:
+        :param start:
+        :param stop:
+        :param budget:
+        :return:
+        """
+        storage = self._physical_obj
+        level, values, count = [ref], [], 0
+        while level and count < budget:
+            batch, level = level[:budget - count], level[budget - count:]
+            records = storage.read_records(child.address for child in batch)
+            for child in batch:
+                node = child.load(records[child.address])
+                count += 1
+                if (start is None or node.key >= start) and (stop is None or node.key < stop) and \
+                        node.value_ref.address and node.value_ref.reference is None:
+                    values.append(node.value_ref)
+                left_ref, right_ref = self._child_refs(node)
+                if start is None or start < node.key:
+                    level.append(left_ref)
+                if stop is None or node.key < stop:
+                    level.append(right_ref)
+            level = [child for child in level if child.address and child.reference is None]
+        storage.advise(child.address for child in level)
+        records = storage.read_records(value_ref.address for value_ref in values)
+        for value_ref in values:
+            value_ref.load(records[value_ref.address])
 
-    def __enter__(self):
-        pass
+    def wait_preloaded(self, timeout=None):
+        if self._preload_thread is not None:
+            self._preload_thread.join(timeout)
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if not self._storage.closed:
-            self.close()
+    def save_hot_set(self):
+        """
+        record the addresses of the loaded nodes under the committed root, top levels first,
+        for preload='hot' on the next open
+        :return:
+        """
+        limit = HOT_SET_LIMIT if self._cache_limit is None else self._cache_limit
+        addresses = []
+        level = [self._tree_ref]
+        while level and len(addresses) < limit:
+            next_level = []
+            for ref in level:
+                node = ref.reference
+                if node is None or not ref.address or len(addresses) >= limit:
+                    continue
+                addresses.append(ref.address)
+                next_level.extend(self._child_refs(node))
+            level = next_level
+        self._physical_obj.lock()
+        if self._physical_obj.generation != self._generation:
+            # compacted since these nodes were loaded: their addresses are not in this file
+            self._physical_obj.unlock()
+            return
+        base = self._physical_obj.read_superblock()
+        boundary = self._physical_obj.size()
+        hot_address = self._physical_obj.write(struct.pack('!%dQ' % len(addresses), *addresses))
+        dead_bytes = self._physical_obj.record_sizes([base['hot_address']] if base['hot_address'] else [])
+        self._physical_obj.update_superblock(
+            hot_address=hot_address, **self._space_totals(base, boundary, dead_bytes)
+        )
 
-# def connect(dbname):
-#     try:
-#         f = open(dbname, 'r+b')
-#     except IOError:
-#         fd = os.open(dbname, os.O_RDWR | os.O_CREAT)
-#         f = os.fdopen(fd, 'r+b')
-#     return DBDB(f)
+    def _read_hot_set(self):
+        hot_address = self._physical_obj.read_superblock()['hot_address']
+        if not hot_address:
+            return []
+        data = self._physical_obj.read(hot_address)
+        return struct.unpack('!%dQ' % (len(data) // 8), data)
 
+    def close(self):
+        """
+        called before the storage is closed; saves the hot set when opened with preload='hot'
+        :return:
+        """
+        self.wait_preloaded()
+        if self._preload == 'hot' and not self._in_transaction():
+            self.save_hot_set()
 
+    def _follow(self, ref):
+        """
+        node_ref to node
+        :param ref:
+        :return:
+        """
+        if self._cache_limit is not None and ref.address:
+            ref_id = id(ref)
+            if ref_id in self._loaded:
+                self._loaded[ref_id] = self._loaded.pop(ref_id)
+            else:
+                self._loaded[ref_id] = ref
+        return ref.get(self._physical_obj)
+
+    def _trim_cache(self):
+        """
+        unload least recently followed referents beyond cache_limit;
+        only called between operations, a half-done path copy still needs its loaded children
+        :return:
+        """
+        if self._cache_limit is None:
+            return
+        while len(self._loaded) > self._cache_limit:
+            _, ref = self._loaded.popitem(last=False)
+            ref.unload()
+
+    def __len__(self):
+        if not self._in_transaction():
+            self._refresh_tree_ref()
+        root = self._follow(self._tree_ref)
+        length = root.length if root else 0
+        overlay = self._overlay()
+        # expired keys stay in the tree until purged, found through the expiry index
+        length -= sum(1 for key in self._expired_keys(root, None, None) if key not in overlay)
+        for key, value in overlay.items():
+            in_tree = self._find_node(root, key) is not None
+            if value is DELETED and in_tree:
+                length -= 1
+            elif value is not DELETED and not in_tree:
+                length += 1
+        return length
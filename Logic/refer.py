@@ -2,14 +2,20 @@
 """
 refer point to real value
 """
+import array
+import json
+import marshal
 import pickle
-from tree import BinaryNode
+import struct
+import sys
 from exception import *
 
 class ValueRef(object):
     """
     python object that refers to a binary blob stored in database
     """
+    __slots__ = ('_refer', '_address')
+
     def __init__(self, refer_to=None, address=0):
         self._refer = refer_to
         self._address = address
@@ -32,6 +38,34 @@ class ValueRef(object):
             self.prepare_to_store(storage)
             self._address = storage.write(self.refer_to_string(self._refer))
 
+    def load(self, string):
+        """
+        set the referent from its record read elsewhere, unless it is loaded already
+        :param string:
+        :return: the referent
+        """
+        refer = self._refer
+        if refer is None:
+            refer = self._refer = self.string_to_refer(string)
+        return refer
+
+    def unload(self):
+        """
+        drop the cached referent of a stored ref, it is read again on next get
+        :return:
+        """
+        if self._address:
+            self._refer = None
+
+    @classmethod
+    def normalize(cls, value):
+        """
+        the value as it reads back after being stored, so a write is the same object before and after
+        :param value:
+        :return:
+        """
+        return value
+
     def string_to_refer(self, string):
         raise NotImplementedError
 
@@ -59,16 +93,134 @@ class StringValueRef(ValueRef):
     """
 
     """
+    __slots__ = ()
+    code = 0
+
     def string_to_refer(self, string):
         return string.decode('utf-8')
 
     def refer_to_string(self, refer):
         return refer.encode('utf-8')
 
+
+class BytesValueRef(ValueRef):
+    """
+    values are bytes, stored as they are
+    """
+    __slots__ = ()
+    code = 1
+
+    def string_to_refer(self, string):
+        return string
+
+    def refer_to_string(self, refer):
+        return bytes(refer)
+
+
+class MarshalValueRef(ValueRef):
+    """
+    values are python builtins (numbers, strings, containers of them), marshal encoded
+    """
+    __slots__ = ()
+    code = 2
+
+    def string_to_refer(self, string):
+        return marshal.loads(string)
+
+    def refer_to_string(self, refer):
+        return marshal.dumps(refer)
+
+
+class JsonValueRef(ValueRef):
+    """
+    values are json documents
+    """
+    __slots__ = ()
+    code = 3
+
+    def string_to_refer(self, string):
+        return json.loads(string.decode('utf-8'))
+
+    def refer_to_string(self, refer):
+        return json.dumps(refer, separators=(',', ':')).encode('utf-8')
+
+
+class PickleValueRef(ValueRef):
+    """
+    values are any picklable object, pickle protocol 5; buffers that support out-of-band
+    pickling (bytearray, PickleBuffer, numpy arrays) are stored after the pickle instead of inside it,
+    and come back as zero-copy views of the record:
+        record -> buffer count, buffer lengths, pickle length (!Q each), pickle, buffers
+    """
+    __slots__ = ()
+    code = 4
+    PROTOCOL = 5
+
+    def string_to_refer(self, string):
+        view = memoryview(string)
+        count = struct.unpack_from('!Q', view, 0)[0]
+        lengths = struct.unpack_from('!%dQ' % (count + 1), view, 8)
+        position = 8 * (count + 2)
+        data = view[position:position + lengths[-1]]
+        position += lengths[-1]
+        buffers = []
+        for length in lengths[:-1]:
+            buffers.append(view[position:position + length])
+            position += length
+        return pickle.loads(data, buffers=buffers)
+
+    def refer_to_string(self, refer):
+        buffers = []
+        data = pickle.dumps(refer, protocol=self.PROTOCOL, buffer_callback=buffers.append)
+        raws = [buffer.raw() for buffer in buffers]
+        header = struct.pack('!%dQ' % (len(raws) + 2), len(raws), *([len(raw) for raw in raws] + [len(data)]))
+        return b''.join([header, data] + raws)
+
+
+class ArrayValueRef(ValueRef):
+    """
+    values are numeric vectors (array.array), stored packed as the typecode and little endian items
+    """
+    __slots__ = ()
+    code = 5
+
+    @classmethod
+    def normalize(cls, value):
+        return value if isinstance(value, array.array) else array.array('d', value)
+
+    def string_to_refer(self, string):
+        vector = array.array(string[:1].decode('ascii'))
+        vector.frombytes(string[1:])
+        if sys.byteorder == 'big':
+            vector.byteswap()
+        return vector
+
+    def refer_to_string(self, refer):
+        refer = self.normalize(refer)
+        if sys.byteorder == 'big':
+            refer = array.array(refer.typecode, refer)
+            refer.byteswap()
+        return refer.typecode.encode('ascii') + refer.tobytes()
+
+
+VALUE_CODECS = {
+    'utf8': StringValueRef,
+    'bytes': BytesValueRef,
+    'marshal': MarshalValueRef,
+    'json': JsonValueRef,
+    'pickle': PickleValueRef,
+    'array': ArrayValueRef,
+}
+
+
 class BinaryNodeRef(ValueRef):
     """
     a ValueRef which could serialise and deserialise a binary node
     """
+    __slots__ = ()
+    # ref class of the node values, see node_ref_for()
+    value_ref = StringValueRef
+
     def prepare_to_store(self, storage):
         if self._refer:
             self._refer.store_refs(storage)
@@ -86,17 +238,24 @@ class BinaryNodeRef(ValueRef):
             'right': refer.right_ref.address,
             'length': refer.length,
         }
+        if refer.expires:
+            _node_dict['expires'] = refer.expires
+        if refer.augment is not None:
+            _node_dict['augment'] = refer.augment
 
         return pickle.dumps(_node_dict)
 
     def string_to_refer(self, string):
+        from Logic.tree import BinaryNode
         node_dict = pickle.loads(string)
         _node = BinaryNode(
-            left_ref=BinaryNodeRef(address=node_dict['left']),
+            left_ref=self.__class__(address=node_dict['left']),
             key=node_dict['key'],
-            value_ref=node_dict['value'],
-            right_ref=BinaryNodeRef(address=node_dict['right']),
+            value_ref=self.value_ref(address=node_dict['value']),
+            right_ref=self.__class__(address=node_dict['right']),
             length=node_dict['length'],
+            expires=node_dict.get('expires', 0),
+            augment=node_dict.get('augment'),
         )
         return _node
 
@@ -107,8 +266,27 @@ class BinaryNodeRef(ValueRef):
         if self._refer:
             return self._refer.length
         else:
-            raise ValueRefLengthError("No length for non-exist binary node!")
+            return 0
 
     @length.setter
     def length(self, _length):
-        self._refer.length = _length
\ No newline at end of file
+        self._refer.length = _length
+
+
+_node_refs = {}
+
+
+def node_ref_for(value_ref):
+    """
+    BinaryNodeRef subclass whose nodes decode their values with value_ref
+    :param value_ref:
+    :return:
+    """
+    if value_ref is BinaryNodeRef.value_ref:
+        return BinaryNodeRef
+    if value_ref not in _node_refs:
+        _node_refs[value_ref] = type('BinaryNodeRef', (BinaryNodeRef, ), {
+            '__slots__': (),
+            'value_ref': value_ref,
+        })
+    return _node_refs[value_ref]
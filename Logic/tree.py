@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
-import pickle
-from refer import BinaryNodeRef
-from Logic import LogicalObject
+from Logic.refer import BinaryNodeRef
+from Logic.logical import LogicalObject
 from exception import *
 
 
@@ -13,7 +12,7 @@ class BinaryTree(LogicalObject):
     node_ref = BinaryNodeRef
 
     def _get(self, node, key):
-        assert isinstance(key, str), "Key should be type string!"
+        assert isinstance(key, self._key_codec.key_type), "Key should be type %s!" % self._key_codec.key_type.__name__
         while node is not None:
             if key < node.key:
                 node = self._follow(node.left_ref)
@@ -23,7 +22,17 @@ class BinaryTree(LogicalObject):
                 return self._follow(node.value_ref)
         raise BinaryTreeKeyError("Node not exist!")
 
-    def _set(self, node, key, value_ref):
+    def _find_node(self, node, key):
+        while node is not None:
+            if key < node.key:
+                node = self._follow(node.left_ref)
+            elif key > node.key:
+                node = self._follow(node.right_ref)
+            else:
+                return node
+        return None
+
+    def _set(self, node, key, value_ref, expires=0, augments=None):
         """
         (Recursively)if key match, update node; if not, insert new node
         inserting or updating the tree doesn't mutate any nodes,
@@ -31,9 +40,11 @@ class BinaryTree(LogicalObject):
         :param node:
         :param key:
         :param value_ref:
+        :param expires: expiry time of the key (see Logic.expiry), 0 for never
+        :param augments: Logic.aggregate.Augments the tree is augmented with, None for none
         :return:
         """
-        assert isinstance(key, str), "Key should be type string!"
+        assert isinstance(key, self._key_codec.key_type), "Key should be type %s!" % self._key_codec.key_type.__name__
         if node is None:
             new_node = BinaryNode(
                 key=key,
@@ -41,45 +52,331 @@ class BinaryTree(LogicalObject):
                 length=1,
                 left_ref=self.node_ref(),
                 right_ref=self.node_ref(),
+                expires=expires,
+                augment=augments.augment(value_ref.reference, augments.empty, augments.empty) if augments else None,
             )
         elif key < node.key:
-            left_ref = self._set(self._follow(node.left_ref), key, value_ref)
-            new_node = BinaryNode.from_node(node, left_ref=left_ref)
+            left_ref = self._set(self._follow(node.left_ref), key, value_ref, expires, augments)
+            new_node = BinaryNode.from_node(
+                node, left_ref=left_ref, augment=self._path_augment(node, augments, left_ref=left_ref)
+            )
         elif key > node.key:
-            right_ref = self._set(self._follow(node.right_ref), key, value_ref)
-            new_node = BinaryNode.from_node(node, right_ref=right_ref)
+            right_ref = self._set(self._follow(node.right_ref), key, value_ref, expires, augments)
+            new_node = BinaryNode.from_node(
+                node, right_ref=right_ref, augment=self._path_augment(node, augments, right_ref=right_ref)
+            )
         else:
             # key match, update value_ref
-            new_node = BinaryNode.from_node(node, value_ref=value_ref)
+            augment = augments.augment(value_ref.reference, node.augment[1], node.augment[2]) if augments else None
+            new_node = BinaryNode.from_node(node, value_ref=value_ref, expires=expires, augment=augment)
         return self.node_ref(refer_to=new_node)
 
-    def _delete(self, node, key):
-        assert isinstance(key, str), "Key should be type string!"
+    def _delete(self, node, key, augments=None):
+        assert isinstance(key, self._key_codec.key_type), "Key should be type %s!" % self._key_codec.key_type.__name__
         if node is None:
             raise BinaryTreeKeyError
         elif key < node.key:
-            new_node = BinaryNode.from_node(node, left_ref=self._delete(self._follow(node.left_ref), key))
+            left_ref = self._delete(self._follow(node.left_ref), key, augments)
+            new_node = BinaryNode.from_node(
+                node, left_ref=left_ref, augment=self._path_augment(node, augments, left_ref=left_ref)
+            )
         elif key > node.key:
-            new_node = BinaryNode.from_node(node, right_ref=self._delete(self._follow(node.right_ref), key))
+            right_ref = self._delete(self._follow(node.right_ref), key, augments)
+            new_node = BinaryNode.from_node(
+                node, right_ref=right_ref, augment=self._path_augment(node, augments, right_ref=right_ref)
+            )
         else:
             left = self._follow(node.left_ref)
             right = self._follow(node.right_ref)
             if left and right:
                 replacement = self.find_max(left)
-                left_ref = self._delete(self._follow(node.left_ref), replacement.key)
+                left_ref = self._delete(self._follow(node.left_ref), replacement.key, augments)
+                augment = None
+                if augments:
+                    augment = (replacement.augment[0], self._summary(left_ref, augments), node.augment[2])
                 new_node = BinaryNode(
                     key=replacement.key,
                     value_ref=replacement.value_ref,
                     length=left_ref.length + 1 + node.right_ref.length,
                     left_ref=left_ref,
                     right_ref=node.right_ref,
+                    expires=replacement.expires,
+                    augment=augment,
                 )
             elif left:
                 return node.left_ref
-            elif right:
+            else:
                 return node.right_ref
         return self.node_ref(refer_to=new_node)
 
+    def _path_augment(self, node, augments, left_ref=None, right_ref=None):
+        """
+        augment of a path copy of node with a new left or right child; the summary of the other,
+        untouched child is the one node already holds, so it needn't be read
+        :param node:
+        :param augments:
+        :param left_ref:
+        :param right_ref:
+        :return:
+        """
+        if not augments:
+            return None
+        own, left, right = node.augment
+        if left_ref is not None:
+            left = self._summary(left_ref, augments)
+        if right_ref is not None:
+            right = self._summary(right_ref, augments)
+        return own, left, right
+
+    def _summary(self, ref, augments):
+        node = self._follow(ref)
+        return augments.summary(node.augment if node is not None else None)
+
+    def _augmented(self, ref, augments):
+        """
+        copy of the tree at ref with the augment of every node recomputed for augments, None to drop them;
+        children first, without recursion, so degenerate trees copy as well. Reads every node and value
+        :param ref:
+        :param augments:
+        :return: the new tree ref
+        """
+        copies = {}  # id(old child ref) -> its copy
+        stack = [ref]
+        while stack:
+            top = stack[-1]
+            node = self._follow(top)
+            if node is None:
+                stack.pop()
+                copies[id(top)] = self.node_ref()
+                continue
+            children = [child for child in self._child_refs(node) if id(child) not in copies]
+            if children:
+                stack.extend(children)
+                continue
+            stack.pop()
+            left_ref, right_ref = copies.pop(id(node.left_ref)), copies.pop(id(node.right_ref))
+            augment = None
+            if augments:
+                augment = augments.augment(
+                    self._follow(node.value_ref), self._summary(left_ref, augments), self._summary(right_ref, augments)
+                )
+            copies[id(top)] = self.node_ref(refer_to=BinaryNode.from_node(
+                node, length=node.length, left_ref=left_ref, right_ref=right_ref, augment=augment
+            ))
+        return copies[id(ref)]
+
+    def _range_summary(self, node, start, stop, augments):
+        """
+        combined summaries of the keys within [start, stop): below the node where the bounds part ways,
+        whole subtrees off the two boundary paths are summarised by their parents, so only the paths are read
+        :param node:
+        :param start:
+        :param stop:
+        :param augments:
+        :return:
+        """
+        while node is not None:
+            if start is not None and node.key < start:
+                node = self._follow(node.right_ref)
+            elif stop is not None and node.key >= stop:
+                node = self._follow(node.left_ref)
+            else:
+                own, left, right = node.augment
+                return augments.combine(
+                    left if start is None else self._summary_from(self._follow(node.left_ref), start, augments),
+                    augments.point(own),
+                    right if stop is None else self._summary_below(self._follow(node.right_ref), stop, augments),
+                )
+        return augments.empty
+
+    def _summary_from(self, node, start, augments):
+        """
+        combined summaries of the keys >= start in the subtree of node
+        """
+        combined = augments.empty
+        while node is not None:
+            if node.key < start:
+                node = self._follow(node.right_ref)
+            else:
+                own, _, right = node.augment
+                combined = augments.combine(combined, augments.point(own), right)
+                node = self._follow(node.left_ref)
+        return combined
+
+    def _summary_below(self, node, stop, augments):
+        """
+        combined summaries of the keys < stop in the subtree of node
+        """
+        combined = augments.empty
+        while node is not None:
+            if node.key >= stop:
+                node = self._follow(node.left_ref)
+            else:
+                own, left, _ = node.augment
+                combined = augments.combine(combined, left, augments.point(own))
+                node = self._follow(node.right_ref)
+        return combined
+
+    def _iter(self, node, start=None, stop=None, now=None, readahead=0):
+        """
+        in-order walk yielding (key, value_ref), skipping subtrees outside [start, stop)
+        :param node:
+        :param start:
+        :param stop:
+        :param now: if given, skip keys expired by then
+        :param readahead: load unread subtrees this many nodes at a time, see _follow_ahead()
+        :return:
+        """
+        stack = []
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                if start is None or start < node.key:
+                    node = self._follow_ahead(node.left_ref, start, stop, readahead)
+                else:
+                    node = None
+                continue
+            node = stack.pop()
+            if stop is not None and node.key >= stop:
+                return
+            if (start is None or node.key >= start) and \
+                    not (now is not None and node.expires and node.expires <= now):
+                yield node.key, node.value_ref
+            node = self._follow_ahead(node.right_ref, start, stop, readahead)
+
+    def _build(self, items):
+        """
+        balanced tree from (key, value_ref) pairs already sorted by key, without path copying
+        :param items:
+        :return: node_ref of the root
+        """
+        if not items:
+            return self.node_ref()
+        middle = len(items) // 2
+        key, value_ref = items[middle]
+        return self.node_ref(refer_to=BinaryNode(
+            key=key,
+            value_ref=value_ref,
+            length=len(items),
+            left_ref=self._build(items[:middle]),
+            right_ref=self._build(items[middle + 1:]),
+        ))
+
+    def _diff(self, old_ref, new_ref):
+        """
+        (key, 'added' | 'removed' | 'changed') between two trees, in key order;
+        both walks advance on a frontier stack of unexpanded subtrees and entries,
+        and a subtree stored at the same address on both sides is skipped whole
+        :param old_ref:
+        :param new_ref:
+        :return:
+        """
+        old_stack, new_stack = [old_ref], [new_ref]
+        while True:
+            self._drop_empty(old_stack)
+            self._drop_empty(new_stack)
+            if not old_stack and not new_stack:
+                return
+            old_top = old_stack[-1] if old_stack else None
+            new_top = new_stack[-1] if new_stack else None
+            old_is_ref = old_top is not None and not isinstance(old_top, tuple)
+            new_is_ref = new_top is not None and not isinstance(new_top, tuple)
+            if old_is_ref and new_is_ref:
+                if old_top.address and old_top.address == new_top.address:
+                    old_stack.pop()
+                    new_stack.pop()
+                    continue
+                # expand only the bigger subtree: the smaller one may be shared with a part of it
+                old_length = self._follow(old_top).length
+                new_length = self._follow(new_top).length
+                if old_length >= new_length:
+                    self._expand(old_stack)
+                if new_length >= old_length:
+                    self._expand(new_stack)
+            elif old_is_ref:
+                self._expand(old_stack)
+            elif new_is_ref:
+                self._expand(new_stack)
+            elif old_top is None or (new_top is not None and new_top[0] < old_top[0]):
+                new_stack.pop()
+                yield new_top[0], 'added'
+            elif new_top is None or old_top[0] < new_top[0]:
+                old_stack.pop()
+                yield old_top[0], 'removed'
+            else:
+                old_stack.pop()
+                new_stack.pop()
+                old_value_ref, new_value_ref = old_top[1], new_top[1]
+                if old_value_ref.address != new_value_ref.address and \
+                        self._follow(old_value_ref) != self._follow(new_value_ref):
+                    yield new_top[0], 'changed'
+
+    def _expand(self, stack):
+        node = self._follow(stack.pop())
+        stack.append(node.right_ref)
+        stack.append((node.key, node.value_ref))
+        stack.append(node.left_ref)
+
+    def _drop_empty(self, stack):
+        while stack and not isinstance(stack[-1], tuple) and self._follow(stack[-1]) is None:
+            stack.pop()
+
+    def _key_at(self, node, rank):
+        """
+        key with the given in-order rank, descending by subtree lengths
+        :param node:
+        :param rank:
+        :return:
+        """
+        while node is not None:
+            left = self._follow(node.left_ref)
+            left_length = left.length if left else 0
+            if rank < left_length:
+                node = left
+            elif rank > left_length:
+                rank -= left_length + 1
+                node = self._follow(node.right_ref)
+            else:
+                return node.key
+        raise BinaryTreeKeyError("Rank out of range!")
+
+    def _unreachable(self, old_address, new_ref, boundary):
+        """
+        addresses of the nodes and values of the stored tree at old_address that new_ref no longer reaches;
+        new_ref is a path copy of it, so only its nodes written at or after boundary (or not yet written)
+        link into the old tree, and the old nodes above those links are the ones replaced
+        :param old_address:
+        :param new_ref:
+        :param boundary: file size before the new tree was written
+        :return:
+        """
+        shared, values = set(), set()
+        stack = [new_ref]
+        while stack:
+            ref = stack.pop()
+            if ref.address and ref.address < boundary:
+                shared.add(ref.address)
+                continue
+            node = self._follow(ref)
+            if node is not None:
+                values.add(node.value_ref.address)
+                stack.extend(self._child_refs(node))
+        dead = []
+        stack = [self.node_ref(address=old_address)]
+        while stack:
+            ref = stack.pop()
+            if not ref.address or ref.address in shared:
+                continue
+            node = self._follow(ref)
+            dead.append(ref.address)
+            if node.value_ref.address and node.value_ref.address not in values:
+                dead.append(node.value_ref.address)
+            stack.extend(self._child_refs(node))
+        return dead
+
+    def _child_refs(self, node):
+        return node.left_ref, node.right_ref
+
     def find_max(self, node):
         while True:
             right_node = self._follow(node.right_ref)
@@ -104,13 +401,20 @@ class BinaryNode(object):
             length ->
             left_ref -> left-child-node
             right_ref -> right-child-node
+            expires -> expiry time of the key, 0 for never
+            augment -> (own numbers, left summaries, right summaries) of an augmented tree
+                (see Logic.aggregate), None for none
     """
-    def __init__(self, key, value_ref, length, left_ref, right_ref):
+    __slots__ = ('key', 'value_ref', 'length', 'left_ref', 'right_ref', 'expires', 'augment')
+
+    def __init__(self, key, value_ref, length, left_ref, right_ref, expires=0, augment=None):
         self.key = key
         self.value_ref = value_ref
         self.length = length
         self.left_ref = left_ref
         self.right_ref = right_ref
+        self.expires = expires
+        self.augment = augment
 
     def store_refs(self, storage):
         self.value_ref.store(storage)
@@ -132,10 +436,12 @@ class BinaryNode(object):
             length += kwargs['right_ref'].length - node.right_ref.length
         new_node = cls(**{
             'key': kwargs.get('key', node.key),
-            'value_ref': kwargs.get('value_ref', node.valuee_ref),
-            'length': kwargs.get('length', node.length),
+            'value_ref': kwargs.get('value_ref', node.value_ref),
+            'length': kwargs.get('length', length),
             'left_ref': kwargs.get('left_ref', node.left_ref),
             'right_ref': kwargs.get('right_ref', node.right_ref),
+            'expires': kwargs.get('expires', node.expires),
+            'augment': kwargs.get('augment', node.augment),
         })
         return new_node
 
@@ -1,17 +1,4 @@
 # -*- coding: utf-8 -*-
-import os
-
-from old.interface import DBDB
+from interface import DBDB, connect
 
 __all__ = ['DBDB', 'connect']
-
-
-def connect(dbname):
-    try:
-        f = open(dbname, 'r+b')
-    except IOError:
-        fd = os.open(dbname, os.O_RDWR | os.O_CREAT)
-        f = os.fdopen(fd, 'r+b')
-    return DBDB(f)
-
-
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+offline file health and tree shape report
+
+one sequential pass over the length-prefixed records gives every record's size,
+then a level by level walk from the committed roots, reading each level in file order,
+tells which of them are live; everything else is garbage a compaction would drop
+"""
+import io
+import math
+import struct
+
+from physical import PhysicalObject
+from Logic.delta import chain_addresses
+from Logic.index import load_catalog
+from Logic.refer import BinaryNodeRef
+
+SCAN_BUFFER = 1 << 20
+PERCENTILES = (50, 90, 99)
+
+
+def scan_records(name):
+    """
+    sizes of all records in file order
+    :param name:
+    :return: ({address: data length}, bytes of a torn record at the end)
+    """
+    sizes = {}
+    with io.open(name, 'rb', buffering=SCAN_BUFFER) as f:
+        f.seek(0, io.SEEK_END)
+        end = f.tell()
+        position = PhysicalObject.SUPERBLOCK_SIZE
+        f.seek(position)
+        while position + PhysicalObject.INTEGER_LENGTH <= end:
+            length = struct.unpack(PhysicalObject.INTEGER_FORMAT, f.read(PhysicalObject.INTEGER_LENGTH))[0]
+            if position + PhysicalObject.INTEGER_LENGTH + length > end:
+                break
+            sizes[position] = length
+            position += PhysicalObject.INTEGER_LENGTH + length
+            f.seek(length, io.SEEK_CUR)
+    return sizes, max(end - position, 0)
+
+
+def distribution(sizes):
+    """
+    summary of a list of sizes: count, total, min, max, mean, percentiles and power of two buckets
+    :param sizes:
+    :return:
+    """
+    sizes = sorted(sizes)
+    if not sizes:
+        return {'count': 0, 'total': 0}
+    buckets = {}
+    for size in sizes:
+        bucket = 1 << size.bit_length() if size else 0
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    summary = {
+        'count': len(sizes),
+        'total': sum(sizes),
+        'min': sizes[0],
+        'max': sizes[-1],
+        'mean': sum(sizes) / float(len(sizes)),
+        'buckets': sorted(buckets.items()),
+    }
+    for percentile in PERCENTILES:
+        summary['p%d' % percentile] = sizes[min(len(sizes) - 1, len(sizes) * percentile // 100)]
+    return summary
+
+
+class TreeWalk(object):
+    """
+    shape and record addresses of one tree, walked level by level
+    """
+    def __init__(self, storage, root_address):
+        self.nodes = []  # node addresses
+        self.values = []  # value addresses
+        self.key_sizes = []
+        self.depths = {}  # depth -> nodes, root at depth 1
+        self.max_imbalance = 0  # largest height difference of two sibling subtrees
+        decode = BinaryNodeRef().string_to_refer
+        children = {}  # address -> (left address, right address)
+        level = [root_address] if root_address else []
+        depth = 0
+        while level:
+            depth += 1
+            self.depths[depth] = len(level)
+            records = storage.read_records(level)
+            next_level = []
+            for address in level:
+                node = decode(records[address])
+                self.nodes.append(address)
+                if node.value_ref.address:
+                    self.values.append(node.value_ref.address)
+                key = node.key
+                self.key_sizes.append(len(key.encode('utf-8') if not isinstance(key, bytes) else key))
+                children[address] = (node.left_ref.address, node.right_ref.address)
+                next_level.extend(child for child in children[address] if child)
+            level = next_level
+        # heights bottom up: every child is in a later level, so reversed walk order sees it first
+        heights = {0: 0}
+        for address in reversed(self.nodes):
+            left, right = children[address]
+            heights[address] = 1 + max(heights[left], heights[right])
+            self.max_imbalance = max(self.max_imbalance, abs(heights[left] - heights[right]))
+
+    @property
+    def height(self):
+        return max(self.depths) if self.depths else 0
+
+    def balance(self):
+        """
+        height over the height of a perfectly balanced tree of the same size, 1.0 at best
+        :return:
+        """
+        if not self.nodes:
+            return 1.0
+        return self.height / float(int(math.ceil(math.log(len(self.nodes) + 1, 2))))
+
+
+def analyze(name):
+    """
+    report on the file name: record sizes, live and garbage bytes, tree shape, key and value sizes
+    :param name:
+    :return: dict
+    """
+    sizes, torn = scan_records(name)
+    storage = PhysicalObject(open(name, 'rb'))
+    try:
+        superblock = storage.read_superblock()
+        tree = TreeWalk(storage, superblock['root_address'])
+        live = set(tree.nodes) | set(tree.values)
+        deltas = chain_addresses(storage, superblock['delta_address'])
+        live.update(deltas)
+        indexes = {}
+        if superblock['index_address']:
+            live.add(superblock['index_address'])
+            catalog = load_catalog(storage.read(superblock['index_address']))
+            for index_name, (root_address, _) in catalog.items():
+                index = TreeWalk(storage, root_address)
+                live.update(index.nodes)
+                indexes[index_name] = len(index.nodes)
+        if superblock['expiry_address']:
+            expiry = TreeWalk(storage, superblock['expiry_address'])
+            live.update(expiry.nodes)
+            indexes['(expiry)'] = len(expiry.nodes)
+        for field in ('hot_address', 'augment_address'):
+            if superblock[field]:
+                live.add(superblock[field])
+    finally:
+        storage.close()
+
+    record_bytes = dict((address, PhysicalObject.INTEGER_LENGTH + length) for address, length in sizes.items())
+    live_bytes = sum(record_bytes[address] for address in live)
+    file_bytes = PhysicalObject.SUPERBLOCK_SIZE + sum(record_bytes.values()) + torn
+    garbage_bytes = file_bytes - PhysicalObject.SUPERBLOCK_SIZE - live_bytes
+    return {
+        'file_bytes': file_bytes,
+        'records': len(sizes),
+        'live_records': len(live),
+        'live_bytes': live_bytes,
+        'garbage_bytes': garbage_bytes,
+        'garbage_ratio': garbage_bytes / float(file_bytes),
+        'torn_tail_bytes': torn,
+        'compacted_bytes': PhysicalObject.SUPERBLOCK_SIZE + live_bytes,
+        'keys': len(tree.nodes),
+        'height': tree.height,
+        'balance': tree.balance(),
+        'max_imbalance': tree.max_imbalance,
+        'depths': sorted(tree.depths.items()),
+        'key_sizes': distribution(tree.key_sizes),
+        'value_sizes': distribution([sizes[address] for address in tree.values]),
+        'node_sizes': distribution([sizes[address] for address in tree.nodes]),
+        'delta_records': len(deltas),
+        'indexes': indexes,
+        'superblock': superblock,
+    }
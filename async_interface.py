@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio client on top of DBDB (python 3 only)
+
+storage work never runs on the event loop:
+    writer -> one DBDB handle on a single-thread executor, so writes,
+              and the file lock they hold, are serialized in call order
+    readers -> one DBDB handle per thread of a reader pool, so
+               independent reads proceed concurrently
+reads issued while this client has uncommitted writes go to the writer
+so that they see those writes.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from interface import connect
+from physical import MemoryObject
+
+
+class AsyncDBDB(object):
+    """
+    awaitable get/set/delete/commit and async iterators for scans
+    """
+    SCAN_BATCH_SIZE = 256
+
+    def __init__(self, dbname, readers=4):
+        if dbname == MemoryObject.NAME:
+            # every handle would get a database of its own
+            raise ValueError('An in-memory database can not be shared by the writer and readers!')
+        self._dbname = dbname
+        self._writer = None
+        self._write_executor = ThreadPoolExecutor(max_workers=1)
+        self._read_executor = ThreadPoolExecutor(max_workers=readers)
+        self._local = threading.local()
+        self._reader_dbs = []
+        self._reader_dbs_lock = threading.Lock()
+        # handles of the scans not finished yet, closed with the client if a scan is abandoned
+        self._scan_dbs = set()
+        self._uncommitted = 0
+        self._closed = False
+
+    async def open(self):
+        self._writer = await self._run_write(connect, self._dbname)
+        return self
+
+    def _reader(self):
+        """
+        per-thread read handle, opened lazily on the reader thread
+        :return:
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = connect(self._dbname)
+            with self._reader_dbs_lock:
+                self._reader_dbs.append(db)
+        return db
+
+    def _assert_not_closed(self):
+        if self._closed:
+            raise ValueError('Database closed!')
+
+    def _run_write(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._write_executor, fn, *args)
+
+    def _run_read(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._read_executor, fn, *args)
+
+    async def get(self, key):
+        self._assert_not_closed()
+        if self._uncommitted:
+            return await self._run_write(self._writer.__getitem__, key)
+        return await self._run_read(lambda: self._reader()[key])
+
+    async def contains(self, key):
+        try:
+            await self.get(key)
+        except KeyError:
+            return False
+        else:
+            return True
+
+    async def set(self, key, value, ttl=None):
+        self._assert_not_closed()
+        self._uncommitted += 1
+        await self._run_write(self._writer.set, key, value, ttl)
+
+    async def delete(self, key):
+        self._assert_not_closed()
+        self._uncommitted += 1
+        await self._run_write(self._writer.__delitem__, key)
+
+    async def commit(self):
+        self._assert_not_closed()
+        pending = self._uncommitted
+        try:
+            await self._run_write(self._writer.commit)
+        finally:
+            self._uncommitted -= pending
+
+    async def items(self, start=None, stop=None):
+        """
+        async iterator of (key, value) in key order, fetched in batches;
+        a scan gets its own handle so it never shares a file position with concurrent reads,
+        released when the scan ends, is aclose()d, or at the latest when the client is closed
+        :param start:
+        :param stop:
+        :return:
+        """
+        self._assert_not_closed()
+        if self._uncommitted:
+            run, db = self._run_write, self._writer
+        else:
+            run, db = self._run_read, await self._run_read(connect, self._dbname)
+            self._scan_dbs.add(db)
+        iterator = db.items(start, stop)
+        batch_size = self.SCAN_BATCH_SIZE
+
+        def next_batch():
+            batch = []
+            for item in iterator:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    break
+            return batch
+
+        try:
+            while True:
+                batch = await run(next_batch)
+                for item in batch:
+                    yield item
+                if len(batch) < batch_size:
+                    return
+        finally:
+            if db is not self._writer:
+                self._scan_dbs.discard(db)
+                db.close()
+
+    async def keys(self, start=None, stop=None):
+        items = self.items(start, stop)
+        try:
+            async for key, _ in items:
+                yield key
+        finally:
+            await items.aclose()
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not None:
+            await self._run_write(self._writer.close)
+        self._write_executor.shutdown()
+        self._read_executor.shutdown()
+        with self._reader_dbs_lock:
+            for db in self._reader_dbs:
+                db.close()
+            self._reader_dbs = []
+        for db in self._scan_dbs:
+            db.close()
+        self._scan_dbs = set()
+
+    async def __aenter__(self):
+        if self._writer is None:
+            await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __aiter__(self):
+        return self.keys()
+
+
+async def connect_async(dbname, readers=4):
+    return await AsyncDBDB(dbname, readers=readers).open()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+string keys (zero padded ids) versus order-preserving binary integer keys:
+random lookups per second and tree node decode time
+
+usage: python benchmarks/keys.py [KEYS] [LOOKUPS]
+"""
+from __future__ import print_function
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from interface import connect
+
+BATCH_SIZE = 10000
+
+
+def node_records(db):
+    """
+    raw bytes of every tree node
+    """
+    tree, storage = db._tree, db._storage
+    records = []
+    stack = [tree._tree_ref]
+    while stack:
+        ref = stack.pop()
+        if not ref.address:
+            continue
+        records.append(storage.read(ref.address))
+        node = tree._follow(ref)
+        stack.append(node.left_ref)
+        stack.append(node.right_ref)
+    return records
+
+
+def run(codec, make_key, ids, lookups):
+    dbname = os.path.join(tempfile.mkdtemp(), 'keys.db')
+    db = connect(dbname, key_codec=codec)
+    for n in range(0, len(ids), BATCH_SIZE):
+        db.update((make_key(i), 'value') for i in ids[n:n + BATCH_SIZE])
+        db.commit()
+    probes = [make_key(random.choice(ids)) for _ in range(lookups)]
+
+    start = time.time()
+    for key in probes:
+        db[key]
+    lookup_rate = lookups / (time.time() - start)
+
+    records = node_records(db)
+    decode = db._tree.node_ref().string_to_refer
+    start = time.time()
+    for data in records:
+        decode(data)
+    decode_us = (time.time() - start) / len(records) * 1e6
+
+    db.close()
+    os.remove(dbname)
+    print('%-6s keys=%d  lookups %8.0f/s  node decode %.2f us  node size %.0f B' % (
+        codec, len(ids), lookup_rate, decode_us, sum(len(r) for r in records) / float(len(records))))
+
+
+def main(argv):
+    keys = int(argv[1]) if len(argv) > 1 else 100000
+    lookups = int(argv[2]) if len(argv) > 2 else 50000
+    ids = list(range(keys))
+    random.shuffle(ids)
+    run('str', lambda i: '%020d' % i, ids, lookups)
+    run('binary', lambda i: i, ids, lookups)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
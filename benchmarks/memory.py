@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+peak RSS of a long-lived writer that touches every key in one transaction,
+with and without a cache_limit
+
+usage: python benchmarks/memory.py [KEYS] [CACHE_LIMIT]
+"""
+from __future__ import print_function
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from interface import connect
+
+BATCH_SIZE = 10000
+
+
+def key_of(i):
+    return 'key%08d' % i
+
+
+def populate(dbname, keys):
+    db = connect(dbname)
+    order = list(range(keys))
+    random.shuffle(order)
+    for n, i in enumerate(order, 1):
+        db[key_of(i)] = 'value%d' % i
+        if n % BATCH_SIZE == 0:
+            db.commit()
+    db.commit()
+    db.close()
+
+
+def peak_rss():
+    """
+    peak resident set size of this process in KiB; ru_maxrss is inherited across fork and exec,
+    so it is only the fallback for systems without /proc
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    # ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def touch_all(dbname, keys, cache_limit):
+    """
+    take the write lock with one set, then read every key inside that transaction
+    """
+    db = connect(dbname, cache_limit=cache_limit)
+    db[key_of(0)] = 'touched'
+    start = time.time()
+    for i in range(keys):
+        db[key_of(i)]
+    elapsed = time.time() - start
+    db.close()
+    max_rss = peak_rss()
+    print('cache_limit=%-8s keys=%d  peak RSS %.1f MiB  %.1fs' % (cache_limit, keys, max_rss / 1024.0, elapsed))
+
+
+def main(argv):
+    keys = int(argv[1]) if len(argv) > 1 else 1000000
+    cache_limit = int(argv[2]) if len(argv) > 2 else 100000
+    dbname = os.path.join(tempfile.mkdtemp(), 'memory.db')
+    print('populating %d keys ...' % keys)
+    # separate processes, so each peak RSS is measured on its own
+    subprocess.check_call([sys.executable, __file__, '--populate', dbname, str(keys)])
+    for limit in ('none', str(cache_limit)):
+        subprocess.check_call([sys.executable, __file__, '--touch', dbname, str(keys), limit])
+    os.remove(dbname)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--touch':
+        _, _, _dbname, _keys, _limit = sys.argv
+        touch_all(_dbname, int(_keys), None if _limit == 'none' else int(_limit))
+    elif len(sys.argv) > 1 and sys.argv[1] == '--populate':
+        populate(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(sys.argv)
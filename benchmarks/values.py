@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+value codecs on a numeric vector payload: stored size, encode and decode time per value,
+and random reads per second through a database written with each codec
+
+usage: python benchmarks/values.py [VALUES] [LENGTH]
+"""
+from __future__ import print_function
+import array
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from interface import connect
+from Logic.refer import VALUE_CODECS
+
+BATCH_SIZE = 10000
+
+# the payload each codec can hold: the same floats in its natural form
+PAYLOADS = {
+    'utf8': lambda vector: json.dumps(vector),
+    'bytes': lambda vector: array.array('d', vector).tobytes(),
+    'marshal': lambda vector: vector,
+    'json': lambda vector: vector,
+    'pickle': lambda vector: bytearray(array.array('d', vector).tobytes()),
+    'array': lambda vector: array.array('d', vector),
+}
+
+
+def run(codec, count, length):
+    vectors = [[random.random() for _ in range(length)] for _ in range(count)]
+    values = [PAYLOADS[codec](vector) for vector in vectors]
+    value_ref = VALUE_CODECS[codec]()
+
+    start = time.time()
+    strings = [value_ref.refer_to_string(value) for value in values]
+    encode_us = (time.time() - start) / count * 1e6
+    start = time.time()
+    for string in strings:
+        value_ref.string_to_refer(string)
+    decode_us = (time.time() - start) / count * 1e6
+
+    dbname = os.path.join(tempfile.mkdtemp(), 'values.db')
+    db = connect(dbname, value_codec=codec)
+    keys = ['%08d' % i for i in range(count)]
+    pairs = list(zip(keys, values))
+    for n in range(0, count, BATCH_SIZE):
+        db.update(pairs[n:n + BATCH_SIZE])
+        db.commit()
+    db.close()
+    db = connect(dbname)
+    probes = [random.choice(keys) for _ in range(count)]
+    start = time.time()
+    for key in probes:
+        db[key]
+    read_rate = count / (time.time() - start)
+    db.close()
+    os.remove(dbname)
+
+    print('%-8s size %7.0f B  encode %7.2f us  decode %7.2f us  reads %8.0f/s' % (
+        codec, sum(len(s) for s in strings) / float(count), encode_us, decode_us, read_rate))
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 20000
+    length = int(argv[2]) if len(argv) > 2 else 64
+    for codec in ('utf8', 'bytes', 'marshal', 'json', 'pickle', 'array'):
+        run(codec, count, length)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
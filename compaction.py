@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+compaction: rewrite a database file with only its live records
+
+the copy is made beside the file and renamed over it; handles still open on the old file
+notice the rename the next time they take the lock or read the superblock, and reopen
+"""
+import os
+import pickle
+import threading
+import time
+
+from physical import PhysicalObject
+from Logic.delta import chain_addresses
+from Logic.index import load_catalog, dump_catalog
+from Logic.refer import BinaryNodeRef, StringValueRef
+from Logic.tree import BinaryNode
+
+
+class _Copier(object):
+    """
+    copies the committed state of one file into another record by record, remembering where
+    each record went, so copying a later state of the same file writes only what changed since
+    """
+    def __init__(self, source, target, max_rate=None):
+        """
+        :param source:
+        :param target:
+        :param max_rate: bytes per second to copy at most, None for no limit
+        """
+        self.source = source
+        self.target = target
+        self.max_rate = max_rate
+        self.moved = {}  # source address -> target address
+        self.links = {}  # target address -> (record bytes, target addresses it references)
+        self.copied = 0
+        self.started = time.time()
+        self._node_ref = BinaryNodeRef()
+
+    def _write(self, data, links=()):
+        address = self.target.write(data)
+        self.links[address] = (PhysicalObject.INTEGER_LENGTH + len(data), links)
+        self.copied += PhysicalObject.INTEGER_LENGTH + len(data)
+        if self.max_rate:
+            ahead = self.copied / float(self.max_rate) - (time.time() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+        return address
+
+    def record(self, address):
+        if not address:
+            return 0
+        if address not in self.moved:
+            self.moved[address] = self._write(self.source.read(address))
+        return self.moved[address]
+
+    def tree(self, root_address):
+        """
+        copy a tree children first, without recursion, so degenerate trees copy as well
+        :param root_address:
+        :return: root address in the target
+        """
+        decode = self._node_ref.string_to_refer
+        nodes = {}  # read, waiting for their children
+        stack = [root_address] if root_address else []
+        while stack:
+            address = stack[-1]
+            if address in self.moved:
+                stack.pop()
+                continue
+            node = nodes.get(address)
+            if node is None:
+                node = nodes[address] = decode(self.source.read(address))
+                for ref in (node.left_ref, node.right_ref):
+                    if ref.address and ref.address not in self.moved:
+                        stack.append(ref.address)
+                continue
+            stack.pop()
+            del nodes[address]
+            new_node = BinaryNode(
+                key=node.key,
+                value_ref=StringValueRef(address=self.record(node.value_ref.address)),
+                length=node.length,
+                left_ref=BinaryNodeRef(address=self.moved.get(node.left_ref.address, 0)),
+                right_ref=BinaryNodeRef(address=self.moved.get(node.right_ref.address, 0)),
+                expires=node.expires,
+                augment=node.augment,
+            )
+            self.moved[address] = self._write(self._node_ref.refer_to_string(new_node), (
+                new_node.value_ref.address, new_node.left_ref.address, new_node.right_ref.address
+            ))
+        return self.moved.get(root_address, 0)
+
+    def deltas(self, head):
+        for address in reversed(chain_addresses(self.source, head)):
+            if address not in self.moved:
+                record = pickle.loads(self.source.read(address))
+                record['prev'] = self.moved.get(record['prev'], 0)
+                self.moved[address] = self._write(pickle.dumps(record), (record['prev'], ))
+        return self.moved.get(head, 0)
+
+    def catalog(self, address):
+        if not address:
+            return 0
+        if address not in self.moved:
+            catalog = load_catalog(self.source.read(address))
+            for name, (root_address, extractor) in catalog.items():
+                catalog[name] = (self.tree(root_address), extractor)
+            self.moved[address] = self._write(
+                dump_catalog(catalog), tuple(root_address for root_address, _ in catalog.values())
+            )
+        return self.moved[address]
+
+    def state(self, superblock):
+        """
+        copy everything superblock references
+        :param superblock:
+        :return: the superblock fields for the target
+        """
+        fields = dict(superblock)
+        fields.update(
+            root_address=self.tree(superblock['root_address']),
+            delta_address=self.deltas(superblock['delta_address']),
+            index_address=self.catalog(superblock['index_address']),
+            expiry_address=self.tree(superblock['expiry_address']),
+            augment_address=self.record(superblock['augment_address']),
+            # the hot set names addresses of the old file
+            hot_address=0,
+            epoch=superblock['epoch'] + 1,
+        )
+        return fields
+
+    def live_bytes(self, fields):
+        """
+        bytes of the target records the state in fields reaches; records copied for an earlier
+        state and replaced by the catch up are already garbage in the new file
+        :param fields:
+        :return:
+        """
+        seen = set()
+        stack = [fields[name] for name in (
+            'root_address', 'delta_address', 'index_address', 'expiry_address', 'augment_address'
+        )]
+        total = 0
+        while stack:
+            address = stack.pop()
+            if not address or address in seen:
+                continue
+            seen.add(address)
+            size, links = self.links[address]
+            total += size
+            stack.extend(links)
+        return total
+
+
+def compact(name, max_rate=None):
+    """
+    rewrite the file name with only the records its committed state reaches; the bulk of the copy
+    runs without the lock, throttled to max_rate, and only the catch up with commits made meanwhile
+    holds it, so writers are blocked for about the size of their own recent changes
+    :param name:
+    :param max_rate: bytes per second for the unlocked part, None for no limit
+    :return: (file size before, file size after)
+    """
+    tmp = name + '.compact'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    os.close(os.open(tmp, os.O_RDWR | os.O_CREAT))
+    source = PhysicalObject(open(name, 'r+b'))
+    target = PhysicalObject(open(tmp, 'r+b'))
+    try:
+        copier = _Copier(source, target, max_rate)
+        copier.state(source.read_superblock())
+        source.lock()
+        copier.max_rate = None
+        fields = copier.state(source.read_superblock())
+        before = source.size()
+        after = target.size()
+        live_bytes = copier.live_bytes(fields)
+        fields.update(live_bytes=live_bytes, dead_bytes=after - PhysicalObject.SUPERBLOCK_SIZE - live_bytes)
+        # records must be durable before the superblock points to them, and both before the rename
+        target.sync()
+        target.commit_root_address(**fields)
+        target.sync()
+        os.rename(tmp, name)
+        return before, after
+    finally:
+        target.close()
+        source.close()
+
+
+def space(name):
+    """
+    committed space accounting of the file name, read without taking the lock
+    :param name:
+    :return: {'file_bytes', 'live_bytes', 'dead_bytes'}
+    """
+    with open(name, 'rb') as f:
+        superblock = PhysicalObject.parse_superblock(
+            f.read(PhysicalObject.INTEGER_LENGTH * len(PhysicalObject.SUPERBLOCK_FIELDS))
+        )
+        f.seek(0, os.SEEK_END)
+        return {
+            'file_bytes': f.tell(),
+            'live_bytes': superblock['live_bytes'],
+            'dead_bytes': superblock['dead_bytes'],
+        }
+
+
+class AutoCompactor(object):
+    """
+    background thread compacting a database file once garbage crosses a threshold
+    """
+    def __init__(self, name, garbage_ratio=0.5, max_file_bytes=None, min_garbage_bytes=1 << 20,
+                 interval=60.0, max_rate=None):
+        """
+        :param name:
+        :param garbage_ratio: compact when dead bytes reach this share of the file
+        :param max_file_bytes: or when the file grows past this size, None for no limit
+        :param min_garbage_bytes: never compact for less garbage than this
+        :param interval: seconds between checks
+        :param max_rate: bytes per second the copy may write, see compact()
+        """
+        self.name = name
+        self.garbage_ratio = garbage_ratio
+        self.max_file_bytes = max_file_bytes
+        self.min_garbage_bytes = min_garbage_bytes
+        self.interval = interval
+        self.max_rate = max_rate
+        self.compactions = 0
+        self.last_error = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def due(self):
+        usage = space(self.name)
+        if usage['dead_bytes'] < self.min_garbage_bytes:
+            return False
+        if self.max_file_bytes is not None and usage['file_bytes'] >= self.max_file_bytes:
+            return True
+        return usage['dead_bytes'] >= self.garbage_ratio * usage['file_bytes']
+
+    def run_once(self):
+        """
+        compact if due
+        :return: whether it compacted
+        """
+        if not self.due():
+            return False
+        compact(self.name, self.max_rate)
+        self.compactions += 1
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                # keep the schedule going, the next round retries
+                self.last_error = e
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -21,4 +21,63 @@ class ValueRefLengthError(DBStandarError):
 class BinaryTreeKeyError(KeyError):
     """
 
-    """
\ No newline at end of file
+    """
+
+class ShardConfigError(DBStandarError):
+    """
+
+    """
+
+
+class TransactionConflictError(DBStandarError):
+    """
+
+    """
+
+
+class SecondaryIndexError(DBStandarError):
+    """
+
+    """
+
+
+class ReplicationError(DBStandarError):
+    """
+
+    """
+
+
+class KeyCodecError(DBStandarError):
+    """
+
+    """
+
+
+class ValueCodecError(DBStandarError):
+    """
+
+    """
+
+
+class ExpiryError(DBStandarError):
+    """
+
+    """
+
+
+class StaleVersionError(DBStandarError):
+    """
+
+    """
+
+
+class AggregateError(DBStandarError):
+    """
+
+    """
+
+
+class ParallelScanError(DBStandarError):
+    """
+
+    """
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+python dictionary API on top of the logical layer
+"""
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+
+from physical import PhysicalObject, MemoryObject
+from Logic.tree import BinaryTree
+from Logic.index import SecondaryIndex
+from exception import *
+
+# nodes per batch read by the parallel_scan workers
+SCAN_READAHEAD = 1024
+
+
+class DBDB(object):
+    """
+    implement the python dictionary API using concrete BinaryTree implementation
+    """
+    def __init__(self, f, **options):
+        """
+        :param f: database file, or a PhysicalObject such as a MemoryObject
+        :param options: passed to the tree, see LogicalObject
+        """
+        self._storage = f if isinstance(f, PhysicalObject) else PhysicalObject(f)
+        # Data stores tend to use more complex types of search trees such as
+        # B-trees, B+ trees, and others to improve the performance.
+        self._tree = BinaryTree(self._storage, **options)
+
+    def _assert_not_closed(self):
+        if self._storage.closed:
+            raise ValueError('Database closed!')
+
+    def commit(self):
+        self._assert_not_closed()
+        self._tree.commit()
+
+    def checkpoint(self):
+        self._assert_not_closed()
+        self._tree.checkpoint()
+
+    def close(self):
+        if not self._storage.closed:
+            self._tree.close()
+        self._storage.close()
+
+    def create_index(self, name, extractor):
+        self._assert_not_closed()
+        self._tree.create_index(name, extractor)
+
+    def drop_index(self, name):
+        self._assert_not_closed()
+        self._tree.drop_index(name)
+
+    def index(self, name):
+        self._assert_not_closed()
+        return SecondaryIndex(self._tree, name)
+
+    def create_aggregate(self, name, projection):
+        self._assert_not_closed()
+        self._tree.create_aggregate(name, projection)
+
+    def drop_aggregate(self, name):
+        self._assert_not_closed()
+        self._tree.drop_aggregate(name)
+
+    def aggregate(self, start=None, stop=None, op='sum', name=None):
+        """
+        :param start:
+        :param stop:
+        :param op: 'count', 'sum', 'min', 'max' or 'avg' of the projected values within [start, stop)
+        :param name: aggregate created with create_aggregate(), may be left out when there is only one
+        :return:
+        """
+        self._assert_not_closed()
+        return self._tree.aggregate(start, stop, op, name)
+
+    def snapshot(self, file_name):
+        """
+        save the committed state of an in-memory database to a file, see MemoryObject.save
+        :param file_name:
+        :return:
+        """
+        self._assert_not_closed()
+        if not isinstance(self._storage, MemoryObject):
+            raise ValueError('Only an in-memory database can be snapshot!')
+        self._storage.save(file_name)
+
+    def codecs(self):
+        self._assert_not_closed()
+        return self._tree.codecs()
+
+    def space(self):
+        self._assert_not_closed()
+        return self._tree.space()
+
+    def version(self):
+        self._assert_not_closed()
+        return self._tree.version()
+
+    def diff(self, old_version, new_version):
+        self._assert_not_closed()
+        return self._tree.diff(old_version, new_version)
+
+    def changes_since(self, version):
+        self._assert_not_closed()
+        return self._tree.changes_since(version)
+
+    def items(self, start=None, stop=None, readahead=None):
+        """
+        :param start:
+        :param stop:
+        :param readahead: nodes read per batch in file order, None for the default given to connect
+        :return:
+        """
+        self._assert_not_closed()
+        return self._tree.items(start, stop, readahead=readahead)
+
+    def keys(self, start=None, stop=None, readahead=None):
+        for key, _ in self.items(start, stop, readahead):
+            yield key
+
+    def parallel_scan(self, fn, workers=4, reducer=None, initial=None, partitions=None):
+        """
+        apply fn to balanced key ranges of the committed tree in worker processes;
+        fn and reducer must be picklable (module level) functions
+        :param fn: called as fn(items) with an iterator of (key, value) for one range
+        :param workers: number of worker processes
+        :param reducer: combines two partial results; if None the partial results are returned as a list
+        :param initial: initial value for reducer
+        :param partitions: number of key ranges, default to workers
+        :return:
+        """
+        self._assert_not_closed()
+        if self._tree._in_transaction():
+            # the workers read the committed tree, they would not see this handle's writes
+            raise ParallelScanError("Commit before a parallel scan, the workers only see committed data!")
+        superblock = self._storage.read_superblock()
+        root_address = superblock['root_address']
+        split_keys = self._tree.split_keys(partitions or workers, root_address=root_address)
+        bounds = [None] + split_keys + [None]
+        if isinstance(self._storage, MemoryObject):
+            # other processes can't see this one's memory: scan the ranges here, one after another
+            results = [
+                fn(self._tree.items(start, stop, root_address, superblock['delta_address']))
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+        else:
+            results = self._scan_in_workers(fn, workers, root_address, superblock['delta_address'], bounds)
+        if reducer is None:
+            return results
+        if initial is None:
+            return reduce(reducer, results)
+        return reduce(reducer, results, initial)
+
+    def _scan_in_workers(self, fn, workers, root_address, delta_address, bounds):
+        # spawn, not fork: a forked worker shares this handle's file offset
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            futures = [
+                executor.submit(_scan_range, self._storage.name, root_address, delta_address, start, stop, fn)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            return [future.result() for future in futures]
+        finally:
+            executor.shutdown()
+
+    def set(self, key, value, ttl=None):
+        """
+        :param key:
+        :param value:
+        :param ttl: seconds until the key expires, None for never
+        :return:
+        """
+        self._assert_not_closed()
+        self._tree.set(key, value, ttl)
+
+    def purge_expired(self):
+        self._assert_not_closed()
+        return self._tree.purge_expired()
+
+    def update(self, pairs):
+        self._assert_not_closed()
+        if hasattr(pairs, 'items'):
+            pairs = pairs.items()
+        self._tree.update(pairs)
+
+    def __getitem__(self, key):
+        self._assert_not_closed()
+        return self._tree.get(key)
+
+    def __setitem__(self, key, value):
+        self._assert_not_closed()
+        return self._tree.set(key, value)
+
+    def __delitem__(self, key):
+        self._assert_not_closed()
+        return self._tree.delete(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        else:
+            return True
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return len(self._tree)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self._storage.closed:
+            self.close()
+
+
+def _scan_range(dbname, root_address, delta_address, start, stop, fn):
+    """
+    worker side of parallel_scan, reading its own handle from the given root
+    """
+    with open(dbname, 'rb') as f:
+        tree = BinaryTree(PhysicalObject(f))
+        return fn(tree.items(start, stop, root_address=root_address, delta_address=delta_address,
+                             readahead=SCAN_READAHEAD))
+
+
+def connect(dbname, load_from=None, **options):
+    """
+    open the database file dbname, created if missing; or with dbname ':memory:', a database held in
+    this process's memory only, see MemoryObject
+    :param dbname:
+    :param load_from: with ':memory:', a database file to load the initial contents from
+    :param options: passed to the tree, see LogicalObject
+    :return:
+    """
+    if dbname == MemoryObject.NAME:
+        return DBDB(MemoryObject(load_from), **options)
+    try:
+        f = open(dbname, 'r+b')
+    except IOError:
+        # create it, then reopen by name so the handle knows its path
+        os.close(os.open(dbname, os.O_RDWR | os.O_CREAT))
+        f = open(dbname, 'r+b')
+    return DBDB(f, **options)
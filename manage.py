@@ -2,10 +2,360 @@
 """
 commandline tool for  database client
 """
+from __future__ import print_function
+import argparse
+import array
+import base64
+import csv
+import io
+import json
+import sys
+import time
 
-def main():
-    pass
+from analyze import analyze
+from compaction import compact
+from interface import connect
+from replication import backup, follow
+from Logic.refer import StringValueRef
+from exception import *
+
+OK = 0
+BAD_ARGS = 1
+BAD_VERB = 2
+BAD_KEY = 3
+BAD_RECORD = 4
+
+FORMATS = ('jsonl', 'csv', 'tsv')
+
+# json has no bytes: they are written as {"$base64": ..}
+BYTES_TAG = '$base64'
+
+
+def _open_input(name):
+    if name == '-':
+        return sys.stdin
+    return io.open(name, 'r', encoding='utf-8', newline='')
+
+
+def _open_output(name):
+    if name == '-':
+        return sys.stdout
+    return io.open(name, 'w', encoding='utf-8', newline='')
+
+
+def read_records(f, fmt):
+    """
+    (key, value) pairs from a jsonl ({"key": .., "value": ..} per line), csv or tsv stream, as read:
+    see import_record for how they are stored
+    :param f:
+    :param fmt:
+    :return:
+    """
+    if fmt == 'jsonl':
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record['key'], record['value']
+    else:
+        for row in csv.reader(f, delimiter=',' if fmt == 'csv' else '\t'):
+            if row:
+                yield row[0], row[1]
+
+
+def to_json(data):
+    """
+    data as json can hold it: bytes become {"$base64": ..}, tuples and arrays lists
+    :param data:
+    :return:
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return {BYTES_TAG: base64.b64encode(bytes(data)).decode('ascii')}
+    if isinstance(data, (list, tuple, array.array)):
+        return [to_json(item) for item in data]
+    if isinstance(data, dict):
+        return dict((key, to_json(value)) for key, value in data.items())
+    return data
+
+
+def from_json(data):
+    """
+    the inverse of to_json, but for the lists, which stay lists
+    :param data:
+    :return:
+    """
+    if isinstance(data, list):
+        return [from_json(item) for item in data]
+    if isinstance(data, dict):
+        if len(data) == 1 and BYTES_TAG in data:
+            return base64.b64decode(data[BYTES_TAG])
+        return dict((key, from_json(value)) for key, value in data.items())
+    return data
+
+
+def _to_cell(data):
+    return data if isinstance(data, str) else json.dumps(to_json(data))
+
+
+def write_records(f, fmt, records):
+    """
+    csv and tsv cells are text: a key or value that isn't a string is written as its json, and reads back as such;
+    only jsonl round trips bytes, integers, tuples and json values
+    """
+    if fmt == 'jsonl':
+        for key, value in records:
+            f.write(json.dumps({'key': to_json(key), 'value': to_json(value)}) + '\n')
+    else:
+        writer = csv.writer(f, delimiter=',' if fmt == 'csv' else '\t', lineterminator='\n')
+        for key, value in records:
+            writer.writerow((_to_cell(key), _to_cell(value)))
+
+
+def import_record(key, value, key_codec, value_ref):
+    """
+    a record as read by read_records, as the database stores it: a value that isn't a string is json encoded
+    for a text database, and decoded from json for the others
+    :param key:
+    :param value:
+    :param key_codec: see DBDB.codecs
+    :param value_ref: see DBDB.codecs
+    :return: (key, value)
+    """
+    key = from_json(key)
+    if isinstance(key, list):
+        key = tuple(key)
+    if key_codec.key_type is str:
+        if not isinstance(key, str):
+            raise KeyCodecError("Key %r is not a string!" % (key, ))
+    else:
+        key_codec.encode(key)
+    if value_ref is StringValueRef:
+        return key, value if isinstance(value, str) else json.dumps(value)
+    try:
+        value = value_ref.normalize(from_json(value))
+        value_ref().refer_to_string(value)
+    except (TypeError, ValueError):
+        raise ValueCodecError("Can not encode value %r!" % (value, ))
+    return key, value
+
+
+class Progress(object):
+    """
+    throughput report on stderr
+    """
+    def __init__(self, verb):
+        self.verb = verb
+        self.count = 0
+        self.start = time.time()
+
+    def report(self, final=False):
+        elapsed = max(time.time() - self.start, 1e-9)
+        print("%s %d records in %.1fs (%.0f records/s)%s" % (
+            self.verb, self.count, elapsed, self.count / elapsed, '' if final else ' ...'
+        ), file=sys.stderr)
+
+
+def cmd_import(args):
+    """
+    one update and commit per batch; a batch is inserted median first, so sorted input doesn't degenerate the tree.
+    records the database can't store are reported and skipped
+    """
+    status = OK
+    progress = Progress('imported')
+    with connect(args.db) as db:
+        key_codec, value_ref = db.codecs()
+        f = _open_input(args.file)
+        try:
+            batch = []
+            for number, (key, value) in enumerate(read_records(f, args.format), 1):
+                try:
+                    batch.append(import_record(key, value, key_codec, value_ref))
+                except (KeyCodecError, ValueCodecError) as e:
+                    print("Bad record %d: %s" % (number, e), file=sys.stderr)
+                    status = BAD_RECORD
+                    continue
+                if len(batch) >= args.batch_size:
+                    db.update(batch)
+                    db.commit()
+                    progress.count += len(batch)
+                    progress.report()
+                    batch = []
+            if batch:
+                db.update(batch)
+                db.commit()
+                progress.count += len(batch)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    progress.report(final=True)
+    return status
+
+
+def cmd_export(args):
+    progress = Progress('exported')
+    with connect(args.db) as db:
+        f = _open_output(args.file)
+        try:
+            def counted(records):
+                for record in records:
+                    progress.count += 1
+                    yield record
+            write_records(f, args.format, counted(db.items(args.start, args.stop, args.readahead)))
+        finally:
+            if f is not sys.stdout:
+                f.close()
+    progress.report(final=True)
+    return OK
+
+
+def cmd_batch(args):
+    """
+    get/set/delete commands from stdin, one per line ("set KEY VALUE"), over a single open handle;
+    writes are committed every batch_size writes and at the end
+    """
+    status = OK
+    writes = 0
+    with connect(args.db) as db:
+        for line in sys.stdin:
+            parts = line.rstrip('\r\n').split(None, 2)
+            if not parts:
+                continue
+            verb = parts[0]
+            try:
+                if verb == 'get' and len(parts) == 2:
+                    sys.stdout.write(db[parts[1]] + '\n')
+                elif verb == 'set' and len(parts) == 3:
+                    db[parts[1]] = parts[2]
+                    writes += 1
+                elif verb == 'delete' and len(parts) == 2:
+                    del db[parts[1]]
+                    writes += 1
+                elif verb == 'commit' and len(parts) == 1:
+                    db.commit()
+                    writes = 0
+                else:
+                    print("Bad command: %s" % line.rstrip('\r\n'), file=sys.stderr)
+                    status = BAD_VERB
+                    continue
+            except KeyError:
+                print("Key not found: %s" % parts[1], file=sys.stderr)
+                status = BAD_KEY
+            if writes >= args.batch_size:
+                db.commit()
+                writes = 0
+        if writes:
+            db.commit()
+    return status
+
+
+def cmd_backup(args):
+    copied = backup(args.src, args.dst, incremental=args.incremental)
+    print("%s -> %s: %d bytes copied" % (args.src, args.dst, copied), file=sys.stderr)
+    return OK
+
+
+def cmd_replicate(args):
+    follow(args.src, args.dst, interval=args.interval, rounds=args.rounds)
+    return OK
+
+
+def cmd_compact(args):
+    before, after = compact(args.db, max_rate=args.max_rate)
+    print("%s: %d -> %d bytes" % (args.db, before, after), file=sys.stderr)
+    return OK
+
+
+def _format_distribution(summary):
+    if not summary['count']:
+        return 'none'
+    return 'n=%d min=%d p50=%d p90=%d p99=%d max=%d mean=%.1f' % (
+        summary['count'], summary['min'], summary['p50'], summary['p90'], summary['p99'],
+        summary['max'], summary['mean'])
+
+
+def cmd_analyze(args):
+    report = analyze(args.db)
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return OK
+    print("file:        %d bytes, %d records" % (report['file_bytes'], report['records']))
+    print("live:        %d bytes in %d records" % (report['live_bytes'], report['live_records']))
+    print("garbage:     %d bytes (%.1f%%)" % (report['garbage_bytes'], report['garbage_ratio'] * 100))
+    print("compaction:  %d bytes after, saves %d bytes" % (
+        report['compacted_bytes'], report['file_bytes'] - report['compacted_bytes']))
+    if report['torn_tail_bytes']:
+        print("torn tail:   %d bytes after the last complete record" % report['torn_tail_bytes'])
+    print("keys:        %d, %d delta records, indexes %s" % (
+        report['keys'], report['delta_records'],
+        ', '.join('%s (%d)' % item for item in sorted(report['indexes'].items())) or 'none'))
+    print("height:      %d, balance %.2f (1.00 is perfect), max sibling height difference %d" % (
+        report['height'], report['balance'], report['max_imbalance']))
+    print("depths:")
+    for depth, count in report['depths']:
+        print("  %4d %d" % (depth, count))
+    print("key sizes:   %s" % _format_distribution(report['key_sizes']))
+    print("value sizes: %s" % _format_distribution(report['value_sizes']))
+    print("node sizes:  %s" % _format_distribution(report['node_sizes']))
+    return OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="database client")
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('import', help="load key/value records, one commit per batch")
+    p.add_argument('db')
+    p.add_argument('file', nargs='?', default='-', help="input file, - for stdin")
+    p.add_argument('--format', choices=FORMATS, default='jsonl')
+    p.add_argument('--batch-size', type=int, default=10000)
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser('export', help="dump key/value records in key order")
+    p.add_argument('db')
+    p.add_argument('file', nargs='?', default='-', help="output file, - for stdout")
+    p.add_argument('--format', choices=FORMATS, default='jsonl')
+    p.add_argument('--start', default=None, help="first key")
+    p.add_argument('--stop', default=None, help="stop before this key")
+    p.add_argument('--readahead', type=int, default=1024, help="nodes read per batch, 0 to read one by one")
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser('batch', help="run get/set/delete/commit commands from stdin over one handle")
+    p.add_argument('db')
+    p.add_argument('--batch-size', type=int, default=1000, help="commit after this many writes")
+    p.set_defaults(func=cmd_batch)
+
+    p = commands.add_parser('backup', help="copy a database, or only what was appended since the last backup")
+    p.add_argument('src')
+    p.add_argument('dst')
+    p.add_argument('--incremental', action='store_true', help="ship only the tail appended since dst was made")
+    p.set_defaults(func=cmd_backup)
+
+    p = commands.add_parser('replicate', help="keep dst a read replica of src")
+    p.add_argument('src')
+    p.add_argument('dst')
+    p.add_argument('--interval', type=float, default=1.0, help="seconds between rounds")
+    p.add_argument('--rounds', type=int, default=None, help="stop after this many rounds")
+    p.set_defaults(func=cmd_replicate)
+
+    p = commands.add_parser('compact', help="rewrite the file with only its live records")
+    p.add_argument('db')
+    p.add_argument('--max-rate', type=int, default=None, help="bytes per second to copy while unlocked")
+    p.set_defaults(func=cmd_compact)
+
+    p = commands.add_parser('analyze', help="report tree shape, live and garbage bytes and record sizes")
+    p.add_argument('db')
+    p.add_argument('--json', action='store_true', help="print the full report as json")
+    p.set_defaults(func=cmd_analyze)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, 'func', None):
+        parser.print_usage(sys.stderr)
+        return BAD_ARGS
+    return args.func(args)
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -16,6 +16,24 @@ class PhysicalObject(object):
     INTEGER_FORMAT = "!Q"  # "Q": unsigned long long; "!": network byte order
     INTEGER_LENGTH = 8
     SUPERBLOCK_SIZE = 4096
+    # integer slots at the head of the superblock, written together on commit
+    SUPERBLOCK_FIELDS = (
+        'root_address',
+        'delta_address',  # head of the delta log chain, 0 for none
+        'index_address',  # secondary index catalog record, 0 for none
+        'key_codec',  # code of the key codec the tree is keyed with, 0 for str
+        'value_codec',  # code of the value serializer, 0 for utf-8 strings
+        'hot_address',  # node addresses to preload on open, 0 for none
+        'expiry_address',  # root of the expiry index tree, 0 for none
+        'live_bytes',  # bytes of the records reachable from the committed state
+        'dead_bytes',  # bytes of the records commits have made unreachable, reclaimed by compaction
+        'augment_address',  # projections the tree nodes keep aggregates of, 0 for none
+        'epoch',  # number of compactions the file went through; each one moves every record
+    )
+    # gap between two records up to which they are fetched with a single read in read_records()
+    READ_GAP = 1 << 16
+    # bytes from a record's start hinted to the kernel by advise()
+    READ_AHEAD = 1 << 12
 
     def __init__(self, file_obj=None, fd=None, file_name=None):
         if file_obj:
@@ -23,30 +41,68 @@ class PhysicalObject(object):
         elif fd:
             self._f = os.fdopen(fd, 'rb+')
         elif file_name:
-            self._f = open(file_name)
+            self._f = open(file_name, 'rb+')
         else:
             raise DBFileNotExistError("No database file found.")
         self.locked = False
+        # bumped each time the file was found replaced by a compacted copy and reopened;
+        # addresses from an older generation mean nothing in the new file
+        self.generation = 0
         self.ensure_block()
 
     def ensure_block(self):
         """
-        ensure each block is the size of SUPERBLOCK_SIZE
+        ensure each block is the size of SUPERBLOCK_SIZE; a file that already has one, or is open
+        read-only, is left alone without taking the lock, so readers open while a writer holds it
         :return:
         """
+        if '+' not in getattr(self._f, 'mode', '+'):
+            return
+        self.seek_end()
+        if self._f.tell() >= self.SUPERBLOCK_SIZE:
+            return
         self.lock()
         self.seek_end()
         end_position = self._f.tell()
         if end_position < self.SUPERBLOCK_SIZE:
             self._f.write(b'\x00' * (self.SUPERBLOCK_SIZE - end_position))
-        self.unlcok()
+        self.unlock()
 
     def lock(self):
+        """
+        take the exclusive file lock
+        :return: True if the lock was newly acquired, False if already held
+        """
         if not self.locked:
             portalocker.lock(self._f, portalocker.LOCK_EX)
             self.locked = True
+            if self._replaced():
+                # compacted while we waited: the lock is on the retired file
+                self.unlock()
+                self._reopen()
+                return self.lock()
+            return True
+        return False
+
+    def _replaced(self):
+        """
+        whether the file name now points to another file than the one open, i.e. it was compacted
+        :return:
+        """
+        if not isinstance(self._f.name, str):
+            return False
+        try:
+            return os.stat(self._f.name).st_ino != os.fstat(self._f.fileno()).st_ino
+        except OSError:
+            return False
+
+    def _reopen(self):
+        name, mode = self._f.name, self._f.mode
+        self._f.close()
+        self._f = open(name, mode)
+        self.generation += 1
 
-    def unlcok(self):
+    def unlock(self):
         if self.locked:
             self._f.flush()
             portalocker.unlock(self._f)
@@ -85,41 +141,268 @@ class PhysicalObject(object):
         self._f.write(data)  # write data
         return current_position
 
+    def size(self):
+        self.seek_end()
+        return self._f.tell()
+
+    def read_bytes(self, position, length):
+        """
+        raw bytes of the file, record boundaries ignored
+        :param position:
+        :param length:
+        :return:
+        """
+        self.seek_to_pos(position)
+        return self._f.read(length)
+
+    def append_bytes(self, data):
+        """
+        append raw bytes, e.g. records shipped from another file
+        :param data:
+        :return: position they were written at
+        """
+        self.lock()
+        self.seek_end()
+        current_position = self._f.tell()
+        self._f.write(data)
+        return current_position
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
     def read(self, position):
         self.seek_to_pos(position)
         length = self.read_int()  # read data length
         data = self._f.read(length)  # read data
         return data
 
-    def commit_root_address(self, root_address):
+    def read_records(self, addresses):
+        """
+        records at addresses, read in file order, nearby records with one read; positional reads
+        leave the file offset alone, so another thread may use this object meanwhile (flushed records only)
+        :param addresses:
+        :return: {address: data}
+        """
+        fd = self._f.fileno()
+        addresses = sorted(set(addresses))
+        records = {}
+        i = 0
+        while i < len(addresses):
+            j = i + 1
+            while j < len(addresses) and addresses[j] - addresses[j - 1] <= self.READ_GAP:
+                j += 1
+            start = addresses[i]
+            span = os.pread(fd, addresses[j - 1] - start + self.READ_GAP, start)
+            for address in addresses[i:j]:
+                offset = address - start
+                length = self.bytes_to_int(span[offset:offset + self.INTEGER_LENGTH])
+                data = span[offset + self.INTEGER_LENGTH:offset + self.INTEGER_LENGTH + length]
+                if len(data) < length:
+                    data = os.pread(fd, length, address + self.INTEGER_LENGTH)
+                records[address] = data
+            i = j
+        return records
+
+    def advise(self, addresses):
+        """
+        hint the kernel to start reading the records at addresses, where posix_fadvise is available
+        :param addresses:
+        :return:
+        """
+        if not hasattr(os, 'posix_fadvise'):
+            return
+        fd = self._f.fileno()
+        for address in sorted(addresses):
+            os.posix_fadvise(fd, address, self.READ_AHEAD, os.POSIX_FADV_WILLNEED)
+
+    def record_sizes(self, addresses):
+        """
+        total size of the records at addresses, length prefixes included; reads only the prefixes
+        :param addresses:
+        :return:
+        """
+        fd = self._f.fileno()
+        return sum(
+            self.INTEGER_LENGTH + self.bytes_to_int(os.pread(fd, self.INTEGER_LENGTH, address))
+            for address in sorted(addresses)
+        )
+
+    def commit_root_address(self, root_address, **fields):
+        """
+        write the superblock and release the lock
+        :param root_address:
+        :param fields: other superblock fields to update, the rest keep their values
+        :return:
+        """
+        fields['root_address'] = root_address
+        self.update_superblock(**fields)
+
+    def update_superblock(self, **fields):
+        """
+        write the given superblock fields, the rest keep their values, and release the lock
+        :param fields:
+        :return:
+        """
         self.lock()
         self._f.flush()
+        superblock = self.read_superblock()
+        superblock.update(fields)
         self.seek_superblock()
-        self.write_int(root_address)
+        # one write, so readers never see a half updated superblock
+        self._f.write(b''.join(self.int_to_bytes(superblock[name]) for name in self.SUPERBLOCK_FIELDS))
         self._f.flush()
-        self.unlcok()
+        self.unlock()
 
-    def get_root_address(self):
+    def read_superblock(self):
+        if not self.locked and self._replaced():
+            self._reopen()
+        # flush drops the read buffer, which may hold a superblock another handle has since rewritten
+        self._f.flush()
         self.seek_superblock()
-        root_address = self.read_int()
-        return root_address
+        return self.parse_superblock(self._f.read(self.INTEGER_LENGTH * len(self.SUPERBLOCK_FIELDS)))
+
+    @classmethod
+    def parse_superblock(cls, data):
+        """
+        superblock fields from the head of a file
+        :param data: its first INTEGER_LENGTH * len(SUPERBLOCK_FIELDS) bytes
+        :return: dict
+        """
+        return dict(
+            (name, struct.unpack(cls.INTEGER_FORMAT, data[i * cls.INTEGER_LENGTH:(i + 1) * cls.INTEGER_LENGTH])[0])
+            for i, name in enumerate(cls.SUPERBLOCK_FIELDS)
+        )
+
+    def get_root_address(self):
+        return self.read_superblock()['root_address']
 
     def close(self):
-        self.unlcok()
+        self.unlock()
         self._f.close()
 
+    @property
+    def name(self):
+        return self._f.name
+
+    @property
     def closed(self):
         return self._f.closed
 
     def __str__(self):
-        assert isinstance(self._f, file)
         return self._f.name
 
 
+class MemoryObject(PhysicalObject):
+    """
+    append-only record storage in a growable bytearray, for a database only this process uses:
+    the same records and superblock as a file, without locking, flushing or system calls
+    """
+
+    NAME = ':memory:'
+
+    def __init__(self, file_name=None):
+        """
+        :param file_name: database file to load the initial contents from, None to start empty
+        """
+        self._data = bytearray(self.SUPERBLOCK_SIZE)
+        if file_name:
+            with open(file_name, 'rb') as f:
+                data = f.read()
+            self._data[:len(data)] = data
+        self._closed = False
+        self.locked = False
+        self.generation = 0
+
+    def lock(self):
+        if not self.locked:
+            self.locked = True
+            return True
+        return False
+
+    def unlock(self):
+        self.locked = False
+
+    def write(self, data):
+        current_position = len(self._data)
+        self._data += self.int_to_bytes(len(data))
+        self._data += data
+        return current_position
+
+    def size(self):
+        return len(self._data)
+
+    def read_bytes(self, position, length):
+        return bytes(self._data[position:position + length])
+
+    def append_bytes(self, data):
+        current_position = len(self._data)
+        self._data += data
+        return current_position
+
+    def sync(self):
+        pass
+
+    def read(self, position):
+        start = position + self.INTEGER_LENGTH
+        return bytes(self._data[start:start + self.bytes_to_int(self._data[position:start])])
+
+    def read_records(self, addresses):
+        return dict((address, self.read(address)) for address in set(addresses))
+
+    def advise(self, addresses):
+        pass
+
+    def record_sizes(self, addresses):
+        return sum(
+            self.INTEGER_LENGTH + self.bytes_to_int(self._data[address:address + self.INTEGER_LENGTH])
+            for address in addresses
+        )
+
+    def update_superblock(self, **fields):
+        superblock = self.read_superblock()
+        superblock.update(fields)
+        data = b''.join(self.int_to_bytes(superblock[name]) for name in self.SUPERBLOCK_FIELDS)
+        self._data[:len(data)] = data
+        self.unlock()
+
+    def read_superblock(self):
+        return self.parse_superblock(bytes(self._data[:self.INTEGER_LENGTH * len(self.SUPERBLOCK_FIELDS)]))
+
+    def save(self, file_name):
+        """
+        snapshot the contents to a database file, which connect() can open, or MemoryObject load;
+        written beside it and renamed over it, so a reader never sees half a snapshot
+        :param file_name:
+        :return:
+        """
+        tmp = file_name + '.snapshot'
+        with open(tmp, 'wb') as f:
+            f.write(self._data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, file_name)
+
+    def close(self):
+        self.unlock()
+        self._closed = True
+
+    @property
+    def name(self):
+        return self.NAME
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __str__(self):
+        return self.NAME
+
+
 if __name__ == '__main__':
     p = PhysicalObject(file_name='../test.db')
-    print isinstance(p.int_to_bytes(100), bytes)
+    print(isinstance(p.int_to_bytes(100), bytes))
     i = p.bytes_to_int(p.int_to_bytes(100))
-    print i
+    print(i)
 
     p.seek_end()
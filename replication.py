@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+log-shipping replication and incremental backup
+
+the file is append-only, so a replica that is a byte prefix of the source
+catches up by appending the source's tail and then taking its superblock
+"""
+import os
+import time
+
+from physical import PhysicalObject
+from exception import *
+
+CHUNK_SIZE = 1 << 20
+# bytes before the replica's end compared with the source to detect a diverged replica
+VERIFY_SIZE = 4096
+
+
+def _open(name, mode):
+    if mode == 'r+b' and not os.path.exists(name):
+        os.close(os.open(name, os.O_RDWR | os.O_CREAT))
+    return PhysicalObject(open(name, mode))
+
+
+def replicate(src, dst):
+    """
+    ship everything appended to src since the last call into dst, then switch dst to src's root;
+    dst readers see either the old or the new root, never a partial state. Once src was compacted
+    dst is no longer a prefix of it, and is replaced by a full copy instead
+    :param src: source database file name
+    :param dst: replica file name, created if missing
+    :return: number of bytes shipped
+    """
+    source = _open(src, 'rb')
+    replica = _open(dst, 'r+b')
+    try:
+        # superblock first: everything it references is already in the file at this size
+        superblock = source.read_superblock()
+        source_size = source.size()
+        replica_size = replica.size()
+        if replica_size > PhysicalObject.SUPERBLOCK_SIZE and replica.read_superblock()['epoch'] != superblock['epoch']:
+            replica.close()
+            source.close()
+            return _copy(src, dst)
+        if replica_size > source_size:
+            raise ReplicationError("Replica %s is larger than source %s!" % (dst, src))
+        verify_start = max(PhysicalObject.SUPERBLOCK_SIZE, replica_size - VERIFY_SIZE)
+        if source.read_bytes(verify_start, replica_size - verify_start) != \
+                replica.read_bytes(verify_start, replica_size - verify_start):
+            raise ReplicationError("Replica %s has diverged from source %s!" % (dst, src))
+        if replica.read_superblock() == superblock and replica_size == source_size:
+            return 0
+
+        replica.lock()
+        position = replica_size
+        while position < source_size:
+            chunk = source.read_bytes(position, min(CHUNK_SIZE, source_size - position))
+            replica.append_bytes(chunk)
+            position += len(chunk)
+        # the tail must be durable before the superblock points into it
+        replica.sync()
+        replica.commit_root_address(**superblock)
+        replica.sync()
+        return source_size - replica_size
+    finally:
+        replica.close()
+        source.close()
+
+
+def follow(src, dst, interval=1.0, rounds=None):
+    """
+    keep dst a read replica of src by replicating every interval seconds
+    :param src:
+    :param dst:
+    :param interval:
+    :param rounds: stop after this many rounds, None for never
+    :return:
+    """
+    n = 0
+    while rounds is None or n < rounds:
+        try:
+            replicate(src, dst)
+        except ReplicationError:
+            # diverged, e.g. src was restored from an older backup: start the replica over
+            _copy(src, dst)
+        n += 1
+        time.sleep(interval)
+
+
+def backup(src, dst, incremental=False):
+    """
+    copy src to dst; incrementally only the tail appended since dst was made,
+    otherwise a full copy written beside dst and renamed over it
+    :param src:
+    :param dst:
+    :param incremental:
+    :return: number of bytes copied
+    """
+    if incremental and os.path.exists(dst):
+        return replicate(src, dst)
+    return _copy(src, dst)
+
+
+def _copy(src, dst):
+    """
+    full copy of src written beside dst and renamed over it; handles open on dst reopen it
+    :param src:
+    :param dst:
+    :return: number of bytes copied
+    """
+    tmp = dst + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    copied = replicate(src, tmp)
+    os.rename(tmp, dst)
+    return copied
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+key-sharded database: N independent DBDB files in one directory,
+each with its own lock, so writes to different shards don't serialize
+"""
+import heapq
+import json
+import os
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+from interface import connect
+from exception import *
+
+
+class ShardedDBDB(object):
+    """
+    python dictionary API over several DBDB shards;
+    keys are partitioned by a stable hash of the key, or by key range
+    (shard i holds boundaries[i-1] <= key < boundaries[i]) for ordered scans
+    """
+    MANIFEST_NAME = 'shards.json'
+    SHARD_NAME_FORMAT = 'shard-%03d.db'
+
+    def __init__(self, directory, shards, partition='hash', boundaries=None):
+        self._directory = directory
+        self._partition = partition
+        self._boundaries = list(boundaries or [])
+        self._dbs = [
+            connect(os.path.join(directory, self.SHARD_NAME_FORMAT % i))
+            for i in range(shards)
+        ]
+        self._dirty = set()
+        self._executor = ThreadPoolExecutor(max_workers=shards)
+
+    def _shard_index(self, key):
+        if self._partition == 'range':
+            return bisect_right(self._boundaries, key)
+        return zlib.crc32(key.encode('utf-8')) % len(self._dbs)
+
+    def _shard(self, key):
+        return self._dbs[self._shard_index(key)]
+
+    def commit(self):
+        """
+        commit every shard written since the last commit, in parallel;
+        each shard commits atomically, but not all of them together
+        :return:
+        """
+        dirty = [self._dbs[i] for i in sorted(self._dirty)]
+        for future in [self._executor.submit(db.commit) for db in dirty]:
+            future.result()
+        self._dirty.clear()
+
+    def close(self):
+        self._executor.shutdown()
+        for db in self._dbs:
+            db.close()
+
+    def items(self, start=None, stop=None):
+        """
+        (key, value) of all shards merged in key order
+        :param start:
+        :param stop:
+        :return:
+        """
+        iterators = [db.items(start, stop) for db in self._dbs]
+        if self._partition == 'range':
+            for iterator in iterators:
+                for item in iterator:
+                    yield item
+        else:
+            for item in heapq.merge(*iterators, key=lambda item: item[0]):
+                yield item
+
+    def keys(self, start=None, stop=None):
+        for key, _ in self.items(start, stop):
+            yield key
+
+    def __getitem__(self, key):
+        return self._shard(key)[key]
+
+    def __setitem__(self, key, value):
+        index = self._shard_index(key)
+        # dirty before the write: a failed one may still have taken the shard's lock, which commit releases
+        self._dirty.add(index)
+        self._dbs[index][key] = value
+
+    def __delitem__(self, key):
+        index = self._shard_index(key)
+        self._dirty.add(index)
+        del self._dbs[index][key]
+
+    def __contains__(self, key):
+        return key in self._shard(key)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return sum(len(db) for db in self._dbs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def connect_sharded(directory, shards=4, partition='hash', boundaries=None):
+    """
+    open (or create) a sharded database in directory;
+    the layout is recorded in a manifest and must match on reopen
+    :param directory:
+    :param shards: number of shards for hash partitioning
+    :param partition: 'hash' or 'range'
+    :param boundaries: sorted split keys for range partitioning, giving len(boundaries) + 1 shards
+    :return:
+    """
+    if partition not in ('hash', 'range'):
+        raise ShardConfigError("Unknown partition %r!" % partition)
+    if partition == 'range':
+        boundaries = sorted(boundaries or [])
+        shards = len(boundaries) + 1
+    else:
+        boundaries = []
+    manifest = {'shards': shards, 'partition': partition, 'boundaries': boundaries}
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    manifest_path = os.path.join(directory, ShardedDBDB.MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            existing = json.load(f)
+        if existing != manifest:
+            raise ShardConfigError("Shard layout %r does not match existing %r!" % (manifest, existing))
+    else:
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+    return ShardedDBDB(directory, shards, partition, boundaries)
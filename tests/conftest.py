@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from interface import connect
+
+
+@pytest.fixture
+def dbname(tmp_path):
+    return str(tmp_path / 'test.db')
+
+
+@pytest.fixture
+def populated(dbname):
+    """
+    1000 keys with their reversed key as value, committed in one update, which inserts them median first
+    :return: (dbname, sorted keys)
+    """
+    keys = ['%05d' % i for i in range(1000)]
+    with connect(dbname) as db:
+        db.update((key, key[::-1]) for key in keys)
+        db.commit()
+    return dbname, keys
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+
+import pytest
+
+from compaction import compact, space
+from analyze import analyze
+from interface import connect
+from exception import AggregateError
+
+
+def number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def length(value):
+    return len(value)
+
+
+def brute(expected, start, stop, op):
+    numbers = [number(value) for key, value in expected.items()
+               if (start is None or key >= start) and (stop is None or key < stop)]
+    numbers = [n for n in numbers if n is not None]
+    if op == 'count':
+        return len(numbers)
+    if op == 'sum':
+        return sum(numbers)
+    if not numbers:
+        return None
+    return {'min': min, 'max': max, 'avg': lambda ns: sum(ns) / len(ns)}[op](numbers)
+
+
+def check(db, expected, rng):
+    for _ in range(20):
+        low, high = sorted(rng.sample(range(300), 2))
+        start, stop = rng.choice([
+            ('%03d' % low, '%03d' % high), (None, '%03d' % high), ('%03d' % low, None), (None, None)
+        ])
+        for op in ('count', 'sum', 'min', 'max', 'avg'):
+            assert db.aggregate(start, stop, op, 'number') == pytest.approx(brute(expected, start, stop, op))
+
+
+@pytest.mark.parametrize('options', [{}, {'delta_log': True, 'checkpoint_bytes': 3000}, {'optimistic': True},
+                                     {'cache_limit': 20}])
+def test_matches_a_full_scan(dbname, options):
+    rng = random.Random(10)
+    db = connect(dbname, **options)
+    expected = {}
+    for _ in range(150):
+        key = '%03d' % rng.randrange(300)
+        expected[key] = str(rng.randrange(-50, 50)) if rng.random() < 0.9 else 'text'
+        db[key] = expected[key]
+    db.commit()
+    db.create_aggregate('number', number)
+    db.create_aggregate('length', length)
+    check(db, expected, rng)
+    db.commit()
+    for _ in range(3):
+        for _ in range(60):
+            key = '%03d' % rng.randrange(300)
+            if key in expected and rng.random() < 0.3:
+                del db[key]
+                del expected[key]
+            else:
+                expected[key] = str(rng.randrange(-50, 50))
+                db[key] = expected[key]
+        # uncommitted writes count too
+        check(db, expected, rng)
+        db.commit()
+        check(db, expected, rng)
+    db.close()
+    with connect(dbname) as db:
+        check(db, expected, rng)
+        assert db.aggregate(op='sum', name='length') == sum(len(value) for value in expected.values())
+
+
+def test_survives_compaction_and_drop(dbname):
+    db = connect(dbname)
+    db.update(('%03d' % i, str(i)) for i in range(100))
+    db.create_aggregate('number', number)
+    db.create_aggregate('length', length)
+    db.commit()
+    del db['050']
+    db.commit()
+    assert space(dbname)['live_bytes'] == analyze(dbname)['live_bytes']
+    compact(dbname)
+    assert db.aggregate('000', '100', 'sum', 'number') == sum(range(100)) - 50
+    db.drop_aggregate('length')
+    db.commit()
+    # the only aggregate left needs no name
+    assert db.aggregate(op='max') == 99
+    with pytest.raises(AggregateError):
+        db.aggregate(name='length')
+    db.close()
+
+
+def test_expired_keys_are_left_out(dbname):
+    with connect(dbname) as db:
+        db.create_aggregate('number', number)
+        db['a'] = '1'
+        db.set('b', '2', ttl=0.05)
+        db.commit()
+        db.set('c', '4', ttl=0.05)
+        assert db.aggregate() == 7
+        time.sleep(0.1)
+        assert db.aggregate() == 1
+        assert db.aggregate(op='count') == len(db) == 1
+
+
+def test_errors(dbname):
+    with connect(dbname) as db:
+        with pytest.raises(AggregateError):
+            db.aggregate()
+        db.create_aggregate('number', number)
+        with pytest.raises(AggregateError):
+            db.create_aggregate('number', number)
+        with pytest.raises(AggregateError):
+            db.create_aggregate('bad', lambda value: 1)
+        with pytest.raises(AggregateError):
+            db.aggregate(op='median')
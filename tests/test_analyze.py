@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from analyze import analyze, distribution
+from interface import connect
+
+
+def test_report_on_a_fresh_tree(dbname):
+    with connect(dbname) as db:
+        db.update(('%03d' % i, 'v' * i) for i in range(100))
+        db.commit()
+    report = analyze(dbname)
+    assert report['keys'] == 100
+    assert report['garbage_bytes'] == 0
+    assert report['value_sizes']['max'] == 99
+    assert report['height'] >= 7
+    assert report['live_bytes'] + 4096 == report['file_bytes']
+
+
+def test_garbage_after_overwrites(dbname):
+    with connect(dbname) as db:
+        db.update(('%03d' % i, 'v') for i in range(100))
+        db.commit()
+        db['050'] = 'changed'
+        db.commit()
+    report = analyze(dbname)
+    assert report['keys'] == 100
+    assert report['garbage_bytes'] > 0
+    assert report['compacted_bytes'] < report['file_bytes']
+
+
+def test_not_blocked_by_a_writer(dbname):
+    with connect(dbname) as db:
+        db['a'] = '1'
+        db.commit()
+    writer = connect(dbname)
+    writer['b'] = '2'
+    reports = []
+    reader = threading.Thread(target=lambda: reports.append(analyze(dbname)))
+    reader.start()
+    reader.join(10)
+    blocked = reader.is_alive()
+    writer.commit()
+    writer.close()
+    reader.join()
+    assert not blocked
+    assert reports[0]['keys'] == 1
+
+
+def test_distribution():
+    summary = distribution([1, 2, 3, 100])
+    assert (summary['count'], summary['total'], summary['min'], summary['max']) == (4, 106, 1, 100)
+    assert distribution([]) == {'count': 0, 'total': 0}
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+
+from async_interface import AsyncDBDB, connect_async
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_set_get_commit(dbname):
+    async def scenario():
+        async with await connect_async(dbname) as db:
+            await db.set('a', '1')
+            # reads see the client's own uncommitted writes
+            assert await db.get('a') == '1'
+            await db.commit()
+            assert await db.get('a') == '1'
+            await db.delete('a')
+            assert not await db.contains('a')
+            await db.commit()
+            assert not await db.contains('a')
+
+    run(scenario())
+
+
+def test_concurrent_reads_and_scan(dbname):
+    async def scenario():
+        async with await connect_async(dbname, readers=4) as db:
+            order = list(range(600))
+            # the tree is unbalanced, sorted inserts would make it a list
+            random.Random(3).shuffle(order)
+            for i in order:
+                await db.set('%04d' % i, str(i))
+            await db.commit()
+            values = await asyncio.gather(*[db.get('%04d' % i) for i in range(0, 600, 7)])
+            assert values == [str(i) for i in range(0, 600, 7)]
+            keys = [key async for key in db.keys()]
+            assert keys == ['%04d' % i for i in range(600)]
+
+    run(scenario())
+
+
+def test_async_with_opens_the_client(dbname):
+    async def scenario():
+        async with AsyncDBDB(dbname) as db:
+            await db.set('a', '1')
+            await db.commit()
+        async with AsyncDBDB(dbname) as db:
+            assert await db.get('a') == '1'
+
+    run(scenario())
+
+
+def test_abandoned_scans_release_their_handles(dbname):
+    async def scenario():
+        db = await connect_async(dbname)
+        for i in range(10):
+            await db.set('%02d' % i, str(i))
+        await db.commit()
+        keys = db.keys()
+        assert await keys.__anext__() == '00'
+        await keys.aclose()
+        assert not db._scan_dbs
+        items = db.items()
+        assert await items.__anext__() == ('00', '0')
+        scan_dbs = list(db._scan_dbs)
+        assert len(scan_dbs) == 1
+        await db.close()
+        assert scan_dbs[0]._storage.closed
+        await items.aclose()
+
+    run(scenario())
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from interface import connect
+
+
+def loaded_referents(db):
+    return len(db._tree._loaded)
+
+
+def test_reads_stay_within_the_limit(populated):
+    dbname, keys = populated
+    with connect(dbname, cache_limit=100) as db:
+        for key in keys:
+            assert db[key] == key[::-1]
+            assert loaded_referents(db) <= 100
+        assert [key for key, _ in db.items()] == keys
+        assert loaded_referents(db) <= 100
+
+
+def test_writes_inside_one_transaction_stay_correct(populated):
+    dbname, keys = populated
+    with connect(dbname, cache_limit=50) as db:
+        for key in keys[::3]:
+            db[key] = 'new'
+        for key in keys:
+            assert db[key] == ('new' if key in set(keys[::3]) else key[::-1])
+        db.commit()
+        assert loaded_referents(db) <= 50
+    with connect(dbname) as db:
+        assert db[keys[0]] == 'new'
+        assert db[keys[1]] == keys[1][::-1]
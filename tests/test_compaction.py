@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from analyze import analyze
+from compaction import compact, space, AutoCompactor
+from interface import connect
+from replication import backup, follow
+from exception import StaleVersionError
+
+
+def tag(value):
+    return value[:1]
+
+
+def churn(db, rounds=5, seed=7):
+    rng = random.Random(seed)
+    expected = dict(db.items())
+    for _ in range(rounds):
+        for _ in range(40):
+            key = '%03d' % rng.randrange(200)
+            if key in expected and rng.random() < 0.3:
+                del db[key]
+                del expected[key]
+            else:
+                expected[key] = 'v%d' % rng.randrange(1000)
+                db[key] = expected[key]
+        db.commit()
+    return expected
+
+
+@pytest.mark.parametrize('options', [{}, {'delta_log': True, 'checkpoint_bytes': 4000}, {'optimistic': True}])
+def test_space_accounting_matches_analyze(dbname, options):
+    db = connect(dbname, **options)
+    if not options.get('delta_log'):
+        db.create_index('tag', tag)
+    churn(db)
+    db.close()
+    accounted, report = space(dbname), analyze(dbname)
+    assert accounted['live_bytes'] == report['live_bytes']
+    assert accounted['file_bytes'] == accounted['live_bytes'] + accounted['dead_bytes'] + 4096
+
+
+def test_compact_keeps_data_and_drops_garbage(dbname):
+    db = connect(dbname)
+    db.create_index('tag', tag)
+    expected = churn(db)
+    reader = connect(dbname)
+    assert dict(reader.items()) == expected
+    before, after = compact(dbname)
+    assert after < before
+    assert analyze(dbname)['garbage_bytes'] == 0
+    # handles open on the old file reopen the compacted one
+    assert dict(reader.items()) == expected
+    expected = churn(db, rounds=1, seed=8)
+    assert dict(reader.items()) == expected
+    assert sorted(key for _, key in reader.index('tag')) == sorted(expected)
+    reader.close()
+    db.close()
+
+
+def test_versions_from_before_compaction_are_refused(dbname):
+    db = connect(dbname)
+    churn(db, rounds=1)
+    version = db.version()
+    compact(dbname)
+    with pytest.raises(StaleVersionError):
+        db.changes_since(version)
+    version = db.version()
+    db['new'] = 'n'
+    db.commit()
+    assert list(db.changes_since(version)) == [('new', 'added')]
+    db.close()
+
+
+def test_replicas_recover_after_compaction(dbname, tmp_path):
+    db = connect(dbname)
+    churn(db, rounds=2)
+    target, replica = str(tmp_path / 'backup.db'), str(tmp_path / 'replica.db')
+    backup(dbname, target)
+    follow(dbname, replica, interval=0, rounds=1)
+    compact(dbname)
+    db['after'] = 'compaction'
+    db.commit()
+    backup(dbname, target, incremental=True)
+    follow(dbname, replica, interval=0, rounds=1)
+    expected = dict(db.items())
+    for name in (target, replica):
+        with connect(name) as copy:
+            assert dict(copy.items()) == expected
+    db.close()
+
+
+def test_auto_compactor(dbname):
+    db = connect(dbname)
+    churn(db, rounds=10)
+    db.close()
+    compactor = AutoCompactor(dbname, garbage_ratio=0.9, min_garbage_bytes=0)
+    assert not compactor.due()
+    compactor = AutoCompactor(dbname, garbage_ratio=0.1, min_garbage_bytes=0)
+    assert compactor.run_once()
+    assert compactor.compactions == 1
+    assert not compactor.run_once()
+
+
+def test_delta_log_handle_commits_after_compaction(dbname):
+    db = connect(dbname, delta_log=True, checkpoint_bytes=1 << 30)
+    expected = churn(db, rounds=3)
+    compact(dbname)
+    db.commit()
+    db['after'] = 'compaction'
+    expected['after'] = 'compaction'
+    db.commit()
+    db.checkpoint()
+    assert dict(db.items()) == expected
+    db.close()
+    accounted, report = space(dbname), analyze(dbname)
+    assert accounted['live_bytes'] == report['live_bytes']
+    with connect(dbname) as reader:
+        assert dict(reader.items()) == expected
+
+
+def test_hot_set_saved_after_compaction(dbname):
+    db = connect(dbname)
+    expected = churn(db, rounds=3)
+    db.close()
+    db = connect(dbname, preload='hot')
+    assert dict(db.items()) == expected
+    compact(dbname)
+    db.close()
+    with connect(dbname, preload='hot') as reader:
+        assert dict(reader.items()) == expected
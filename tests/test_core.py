@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from interface import connect
+from Logic.refer import BinaryNodeRef
+
+
+def test_set_get_delete_and_reopen(dbname):
+    db = connect(dbname)
+    db['a'] = '1'
+    db['b'] = '2'
+    db.commit()
+    del db['a']
+    db.commit()
+    db.close()
+
+    db = connect(dbname)
+    assert db['b'] == '2'
+    assert 'a' not in db
+    with pytest.raises(KeyError):
+        db['a']
+    db.close()
+
+
+def test_uncommitted_writes_are_not_persisted(dbname):
+    db = connect(dbname)
+    db['a'] = '1'
+    db.commit()
+    db['b'] = '2'
+    db.close()
+    with connect(dbname) as db:
+        assert dict(db.items()) == {'a': '1'}
+
+
+def test_items_are_ordered_and_ranged(dbname):
+    db = connect(dbname)
+    keys = ['%03d' % i for i in range(100)]
+    random.Random(1).shuffle(keys)
+    for key in keys:
+        db[key] = key
+    db.commit()
+    assert list(db.keys()) == sorted(keys)
+    assert list(db.keys('010', '015')) == ['010', '011', '012', '013', '014']
+    db.close()
+
+
+def test_length_after_inserts_updates_and_deletes(dbname):
+    db = connect(dbname)
+    expected = {}
+    rng = random.Random(2)
+    for _ in range(300):
+        key = '%02d' % rng.randrange(60)
+        if key in expected and rng.random() < 0.4:
+            del db[key]
+            del expected[key]
+        else:
+            db[key] = 'x'
+            expected[key] = 'x'
+        assert len(db) == len(expected)
+    db.commit()
+    db.close()
+    with connect(dbname) as db:
+        assert len(db) == len(expected)
+        assert sorted(db.keys()) == sorted(expected)
+
+
+def test_delete_leaf_and_only_key(dbname):
+    db = connect(dbname)
+    db['only'] = '1'
+    del db['only']
+    assert len(db) == 0
+    assert list(db.items()) == []
+    db.commit()
+    db.close()
+
+
+def test_empty_ref_has_zero_length():
+    assert BinaryNodeRef().length == 0
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from interface import connect
+
+
+def test_commit_appends_a_delta_and_leaves_the_tree(dbname):
+    db = connect(dbname, delta_log=True)
+    db['a'] = '1'
+    db.commit()
+    root_address, delta_address = db.version()[:2]
+    assert root_address == 0 and delta_address
+    db['b'] = '2'
+    del db['a']
+    db.commit()
+    assert db.version()[0] == 0
+    assert dict(db.items()) == {'b': '2'}
+    db.close()
+    with connect(dbname) as reader:
+        assert dict(reader.items()) == {'b': '2'}
+        assert len(reader) == 1
+
+
+def test_checkpoint_folds_the_log_into_the_tree(dbname):
+    db = connect(dbname, delta_log=True, checkpoint_bytes=1 << 30)
+    for i in range(20):
+        db['%02d' % i] = str(i)
+        db.commit()
+    db.checkpoint()
+    root_address, delta_address = db.version()[:2]
+    assert root_address and not delta_address
+    assert dict(db.items()) == dict(('%02d' % i, str(i)) for i in range(20))
+    db.close()
+
+
+def test_automatic_checkpoint(dbname):
+    db = connect(dbname, delta_log=True, checkpoint_bytes=500)
+    for i in range(50):
+        db['%02d' % i] = 'x' * 20
+        db.commit()
+    assert db.version()[0]
+    assert len(db) == 50
+    db.close()
+
+
+def test_tree_writer_folds_committed_deltas(dbname):
+    logger = connect(dbname, delta_log=True)
+    logger['a'] = '1'
+    logger['b'] = '2'
+    logger.commit()
+    writer = connect(dbname)
+    writer['c'] = '3'
+    writer.commit()
+    assert writer.version()[1] == 0
+    assert dict(logger.items()) == {'a': '1', 'b': '2', 'c': '3'}
+    writer.close()
+    logger.close()
+
+
+def test_empty_commit_keeps_another_writers_commit(dbname):
+    a = connect(dbname, delta_log=True)
+    b = connect(dbname)
+    a['x'] = '1'
+    a.commit()
+    b['y'] = '2'
+    b.commit()
+    a.commit()
+    b.close()
+    assert dict(a.items()) == {'x': '1', 'y': '2'}
+    a.close()
+    with connect(dbname) as reader:
+        assert dict(reader.items()) == {'x': '1', 'y': '2'}
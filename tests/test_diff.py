@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from interface import connect
+
+
+@pytest.mark.parametrize('options', [{}, {'delta_log': True}])
+def test_changes_between_versions(dbname, options):
+    db = connect(dbname, **options)
+    db.update(('%03d' % i, str(i)) for i in range(50))
+    db.commit()
+    before = db.version()
+    db['010'] = 'changed'
+    db['011'] = '11'  # same value: not a change
+    del db['020']
+    db['new'] = 'n'
+    db.commit()
+    expected = [('010', 'changed'), ('020', 'removed'), ('new', 'added')]
+    assert list(db.changes_since(before)) == expected
+    assert list(db.diff(before, db.version())) == expected
+    assert list(db.diff(db.version(), before)) == [('010', 'changed'), ('020', 'added'), ('new', 'removed')]
+    assert list(db.changes_since(db.version())) == []
+    db.close()
+
+
+def test_bare_root_addresses(dbname):
+    db = connect(dbname)
+    db['a'] = '1'
+    db.commit()
+    old_root = db.version()[0]
+    db['b'] = '2'
+    db.commit()
+    assert list(db.diff(old_root, db.version()[0])) == [('b', 'added')]
+    db.close()
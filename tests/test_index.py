@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from interface import connect
+from exception import SecondaryIndexError
+
+
+def city(value):
+    return value.split(',')[0] if ',' in value else None
+
+
+def test_backfill_and_lookup(dbname):
+    db = connect(dbname)
+    db.update([('ann', 'oslo,1'), ('bob', 'rome,2'), ('cid', 'oslo,3'), ('dan', 'none')])
+    db.commit()
+    db.create_index('city', city)
+    db.commit()
+    assert sorted(db.index('city').get('oslo')) == ['ann', 'cid']
+    assert list(db.index('city').range('p')) == [('rome', 'bob')]
+    assert list(db.index('city')) == [('oslo', 'ann'), ('oslo', 'cid'), ('rome', 'bob')]
+    db.close()
+
+
+def test_maintained_on_commit_and_persisted(dbname):
+    db = connect(dbname)
+    db.create_index('city', city)
+    db['ann'] = 'oslo,1'
+    db['bob'] = 'rome,2'
+    db.commit()
+    db['ann'] = 'rome,1'
+    del db['bob']
+    db['eve'] = 'paris,5'
+    db.commit()
+    db.close()
+    with connect(dbname) as db:
+        assert db.index('city').get('oslo') == []
+        assert db.index('city').get('rome') == ['ann']
+        assert db.index('city').get('paris') == ['eve']
+
+
+def test_drop_index(dbname):
+    db = connect(dbname)
+    db.create_index('city', city)
+    db.commit()
+    db.drop_index('city')
+    db.commit()
+    with pytest.raises(SecondaryIndexError):
+        db.index('city').get('oslo')
+    db.close()
+
+
+def test_extractor_must_be_module_level(dbname):
+    with connect(dbname) as db:
+        with pytest.raises(SecondaryIndexError):
+            db.create_index('bad', lambda value: value)
+
+
+def test_duplicate_index_is_refused(dbname):
+    with connect(dbname) as db:
+        db.create_index('city', city)
+        with pytest.raises(SecondaryIndexError):
+            db.create_index('city', city)
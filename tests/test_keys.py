@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from interface import connect
+from Logic.keys import encode_key, decode_key
+from exception import KeyCodecError
+
+KEYS = [
+    b'', b'\x00', b'\x00\x01', b'a', b'a\x00', b'b',
+    '', '\x00', 'a', 'a\x00b', u'é', u'中',
+    -(1 << 63), -2, -1, 0, 1, 2, 255, 256, (1 << 64) - 1,
+    (1, 'a'), (1, 'a', 2), (1, 'b'), (2, ),
+]
+
+
+def sort_key(key):
+    # the documented order: bytes < str < negative int < non-negative int, tuples element-wise
+    elements = key if isinstance(key, tuple) else (key, )
+    rank = lambda e: 0 if isinstance(e, bytes) else 1 if isinstance(e, str) else 2
+    return [(rank(e), e if not isinstance(e, str) else e.encode('utf-8')) for e in elements]
+
+
+def test_round_trip():
+    for key in KEYS:
+        expected = key[0] if isinstance(key, tuple) and len(key) == 1 else key
+        assert decode_key(encode_key(key)) == expected
+
+
+def test_byte_order_is_key_order():
+    assert sorted(KEYS, key=encode_key) == sorted(KEYS, key=sort_key)
+
+
+def test_unencodable_keys():
+    for key in (1.5, 1 << 64, -(1 << 63) - 1, None, True):
+        with pytest.raises(KeyCodecError):
+            encode_key(key)
+
+
+def test_binary_database_scans_in_key_order(dbname):
+    db = connect(dbname, key_codec='binary')
+    numbers = list(range(-500, 500, 3))
+    random.Random(5).shuffle(numbers)
+    for number in numbers:
+        db[number] = str(number)
+    db[('user', 7)] = 'tuple'
+    db.commit()
+    db.close()
+    with connect(dbname) as db:
+        assert list(db.keys(-10, 10)) == [n for n in sorted(numbers) if -10 <= n < 10]
+        assert db[-497] == '-497'
+        assert db[('user', 7)] == 'tuple'
+
+
+def test_codec_is_recorded(dbname):
+    with connect(dbname, key_codec='binary') as db:
+        db[1] = 'one'
+        db.commit()
+    with pytest.raises(KeyCodecError):
+        connect(dbname, key_codec='str')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import pytest
+
+import manage
+from interface import connect
+
+
+@pytest.mark.parametrize('fmt', manage.FORMATS)
+def test_import_export_round_trip(dbname, tmp_path, fmt):
+    records = [('%03d' % i, 'value, %d' % i) for i in range(50, 0, -1)]
+    source = str(tmp_path / ('in.' + fmt))
+    with io.open(source, 'w', encoding='utf-8', newline='') as f:
+        manage.write_records(f, fmt, records)
+    assert manage.main(['import', dbname, source, '--format', fmt, '--batch-size', '7']) == manage.OK
+    target = str(tmp_path / ('out.' + fmt))
+    assert manage.main(['export', dbname, target, '--format', fmt, '--start', '010', '--stop', '020']) == manage.OK
+    with io.open(target, encoding='utf-8', newline='') as f:
+        exported = list(manage.read_records(f, fmt))
+    assert exported == sorted(record for record in records if '010' <= record[0] < '020')
+
+
+def test_export_to_stdout(dbname, monkeypatch):
+    with connect(dbname) as db:
+        db['k'] = 'v'
+        db.commit()
+    out = io.StringIO()
+    monkeypatch.setattr('sys.stdout', out)
+    manage.main(['export', dbname])
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == [{'key': 'k', 'value': 'v'}]
+
+
+def test_batch_commands(dbname, monkeypatch):
+    monkeypatch.setattr('sys.stdin', io.StringIO('set a 1\nset b two words\nget b\ndelete a\nget a\nbogus\n'))
+    out = io.StringIO()
+    monkeypatch.setattr('sys.stdout', out)
+    status = manage.main(['batch', dbname, '--batch-size', '2'])
+    assert out.getvalue() == 'two words\n'
+    assert status == manage.BAD_VERB
+    with connect(dbname) as db:
+        assert dict(db.items()) == {'b': 'two words'}
+
+
+def test_missing_command():
+    assert manage.main([]) == manage.BAD_ARGS
+
+
+def test_import_json_encodes_values_of_a_text_database(dbname, tmp_path):
+    source = str(tmp_path / 'in.jsonl')
+    with io.open(source, 'w', encoding='utf-8') as f:
+        f.write(u'{"key": "n", "value": 7}\n{"key": "o", "value": {"a": [1, 2]}}\n{"key": "s", "value": "text"}\n')
+    assert manage.main(['import', dbname, source]) == manage.OK
+    with connect(dbname) as db:
+        assert dict(db.items()) == {'n': '7', 'o': '{"a": [1, 2]}', 's': 'text'}
+
+
+def test_import_reports_and_skips_bad_records(dbname, tmp_path, capsys):
+    with connect(dbname, value_codec='bytes') as db:
+        db['kept'] = b'\x00'
+        db.commit()
+    source = str(tmp_path / 'in.jsonl')
+    with io.open(source, 'w', encoding='utf-8') as f:
+        f.write(u'{"key": 1, "value": {"$base64": "AQ=="}}\n{"key": "a", "value": "text"}\n'
+                u'{"key": "b", "value": {"$base64": "Ag=="}}\n')
+    assert manage.main(['import', dbname, source]) == manage.BAD_RECORD
+    errors = capsys.readouterr().err
+    assert 'Bad record 1' in errors and 'Bad record 2' in errors and 'Bad record 3' not in errors
+    with connect(dbname) as db:
+        assert dict(db.items()) == {'kept': b'\x00', 'b': b'\x02'}
+
+
+@pytest.mark.parametrize('fmt', manage.FORMATS)
+def test_export_binary_keys_and_values(dbname, tmp_path, fmt):
+    records = [(b'\x00raw', b'\xff\x00'), (7, b''), (('user', 3), b'v')]
+    with connect(dbname, key_codec='binary', value_codec='bytes') as db:
+        db.update(records)
+        db.commit()
+    target = str(tmp_path / ('out.' + fmt))
+    assert manage.main(['export', dbname, target, '--format', fmt]) == manage.OK
+    copy = str(tmp_path / 'copy.db')
+    with connect(copy, key_codec='binary', value_codec='bytes') as db:
+        db.commit()
+    if fmt == 'jsonl':
+        assert manage.main(['import', copy, target, '--format', fmt]) == manage.OK
+        with connect(copy) as db:
+            assert dict(db.items()) == dict(records)
+    else:
+        with io.open(target, encoding='utf-8', newline='') as f:
+            cells = list(manage.read_records(f, fmt))
+        assert [json.loads(key) for key, _ in cells] == [{'$base64': 'AHJhdw=='}, ['user', 3], 7]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from async_interface import connect_async
+from interface import connect
+
+
+def count_items(items):
+    return sum(1 for _ in items)
+
+
+@pytest.mark.parametrize('options', [{}, {'delta_log': True}, {'optimistic': True}, {'cache_limit': 10}])
+def test_behaves_like_a_file(options):
+    db = connect(':memory:', **options)
+    db.update(('%03d' % i, str(i)) for i in range(200))
+    db.commit()
+    del db['000']
+    db['new'] = 'n'
+    db.commit()
+    assert len(db) == 200
+    assert db['100'] == '100'
+    assert list(db.keys('010', '013')) == ['010', '011', '012']
+    usage = db.space()
+    assert usage['file_bytes'] == usage['live_bytes'] + usage['dead_bytes'] + 4096
+    db.close()
+
+
+def test_snapshot_and_load(tmp_path):
+    path = str(tmp_path / 'snapshot.db')
+    db = connect(':memory:')
+    db['a'] = '1'
+    db.commit()
+    db['uncommitted'] = 'u'
+    db.snapshot(path)
+    db.close()
+    with connect(path) as copy:
+        assert dict(copy.items()) == {'a': '1'}
+        copy['b'] = '2'
+        copy.commit()
+    with connect(':memory:', load_from=path) as loaded:
+        assert dict(loaded.items()) == {'a': '1', 'b': '2'}
+        loaded['c'] = '3'
+        loaded.commit()
+    # loading doesn't write back to the file
+    with connect(path) as copy:
+        assert 'c' not in copy
+
+
+def test_handles_do_not_share_memory():
+    first, second = connect(':memory:'), connect(':memory:')
+    first['a'] = '1'
+    first.commit()
+    assert 'a' not in second
+
+
+def test_parallel_scan_runs_in_process():
+    with connect(':memory:') as db:
+        db.update(('%03d' % i, str(i)) for i in range(100))
+        db.commit()
+        assert db.parallel_scan(count_items, workers=3, reducer=lambda a, b: a + b) == 100
+
+
+def test_snapshot_needs_memory(dbname, tmp_path):
+    with connect(dbname) as db:
+        with pytest.raises(ValueError):
+            db.snapshot(str(tmp_path / 'copy.db'))
+
+
+def test_async_client_refuses_memory():
+    with pytest.raises(ValueError):
+        asyncio.run(connect_async(':memory:'))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from interface import connect
+from exception import TransactionConflictError
+
+
+@pytest.fixture
+def handles(dbname):
+    with connect(dbname) as db:
+        db.update([('a', '1'), ('b', '2')])
+        db.commit()
+    first, second = connect(dbname, optimistic=True), connect(dbname, optimistic=True)
+    yield first, second
+    first.close()
+    second.close()
+
+
+def test_writes_do_not_take_the_lock(handles, dbname):
+    first, _ = handles
+    first['a'] = 'x'
+    # another writer is not blocked by the open transaction
+    with connect(dbname) as other:
+        other['c'] = '3'
+        other.commit()
+    first.commit()
+    with connect(dbname) as db:
+        assert dict(db.items()) == {'a': 'x', 'b': '2', 'c': '3'}
+
+
+def test_disjoint_transactions_rebase(handles, dbname):
+    first, second = handles
+    first['a'] = 'first'
+    second['b'] = 'second'
+    second.commit()
+    first.commit()
+    with connect(dbname) as db:
+        assert dict(db.items()) == {'a': 'first', 'b': 'second'}
+
+
+def test_conflicting_transaction_is_refused(handles, dbname):
+    first, second = handles
+    first['a'] = 'first'
+    second['a'] = 'second'
+    second.commit()
+    with pytest.raises(TransactionConflictError):
+        first.commit()
+    # the failed transaction is dropped, the handle reads the committed state
+    assert first['a'] == 'second'
+    first['b'] = 'again'
+    first.commit()
+    with connect(dbname) as db:
+        assert dict(db.items()) == {'a': 'second', 'b': 'again'}
+
+
+def test_deleted_key_conflicts(handles):
+    first, second = handles
+    first['b'] = 'first'
+    del second['b']
+    second.commit()
+    with pytest.raises(TransactionConflictError):
+        first.commit()
+
+
+def test_reads_see_own_writes(handles):
+    first, second = handles
+    first['new'] = 'n'
+    assert first['new'] == 'n'
+    assert 'new' not in second
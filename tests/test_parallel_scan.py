@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from interface import connect
+from exception import ParallelScanError
+
+
+def count_items(items):
+    return sum(1 for _ in items)
+
+
+def first_key(items):
+    for key, _ in items:
+        return key
+    return None
+
+
+def add(a, b):
+    return a + b
+
+
+@pytest.fixture
+def db(dbname):
+    db = connect(dbname)
+    db.update(('%04d' % i, str(i)) for i in range(500))
+    db.commit()
+    yield db
+    db.close()
+
+
+def test_scan_covers_every_key_once(db):
+    assert db.parallel_scan(count_items, workers=2, reducer=add) == 500
+    assert db.parallel_scan(count_items, workers=2, reducer=add, initial=10) == 510
+
+
+def test_ranges_are_balanced_and_ordered(db):
+    counts = db.parallel_scan(count_items, workers=2, partitions=4)
+    assert sum(counts) == 500
+    assert max(counts) - min(counts) <= 2
+    firsts = db.parallel_scan(first_key, workers=2, partitions=4)
+    assert firsts == sorted(firsts)
+
+
+def test_refused_with_uncommitted_writes(db):
+    db['extra'] = 'y'
+    with pytest.raises(ParallelScanError):
+        db.parallel_scan(count_items, workers=2)
+    db.commit()
+    assert db.parallel_scan(count_items, workers=2, reducer=add) == 501
+
+
+def test_not_blocked_by_another_writer(db, dbname):
+    writer = connect(dbname)
+    writer['held'] = 'lock'
+    result = []
+    scan = threading.Thread(target=lambda: result.append(db.parallel_scan(count_items, workers=2, reducer=add)))
+    scan.start()
+    scan.join(60)
+    writer.commit()
+    writer.close()
+    assert not scan.is_alive()
+    assert result == [500]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from interface import connect
+
+
+def loaded_nodes(db):
+    count, stack = 0, [db._tree._tree_ref]
+    while stack:
+        node = stack.pop().reference
+        if node is not None:
+            count += 1
+            stack.extend((node.left_ref, node.right_ref))
+    return count
+
+
+def test_preload_levels(populated):
+    dbname, _ = populated
+    with connect(dbname, preload=3) as db:
+        assert loaded_nodes(db) == 7
+        assert db['00010'] == '01000'
+
+
+def test_preload_whole_tree_in_background(populated):
+    dbname, _ = populated
+    with connect(dbname, preload=64, preload_background=True) as db:
+        db._tree.wait_preloaded()
+        assert loaded_nodes(db) == 1000
+
+
+def test_hot_set_is_saved_and_reloaded(populated):
+    dbname, keys = populated
+    probes = keys[::50]
+    with connect(dbname, preload='hot') as db:
+        for key in probes:
+            db[key]
+        hot = loaded_nodes(db)
+    with connect(dbname, preload='hot') as db:
+        assert loaded_nodes(db) == hot
+        assert [db[key] for key in probes] == [key[::-1] for key in probes]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from interface import connect
+
+
+@pytest.mark.parametrize('readahead', [1, 7, 64, 4096])
+@pytest.mark.parametrize('bounds', [(None, None), ('00100', '00200'), ('00999', None), (None, '00001')])
+def test_same_items_as_a_plain_scan(populated, readahead, bounds):
+    dbname, keys = populated
+    start, stop = bounds
+    expected = [(key, key[::-1]) for key in keys
+                if (start is None or key >= start) and (stop is None or key < stop)]
+    with connect(dbname, cache_limit=100) as db:
+        assert list(db.items(start, stop, readahead=readahead)) == expected
+
+
+def test_batched_reads_replace_record_by_record_reads(populated):
+    dbname, keys = populated
+    with connect(dbname, readahead=256) as db:
+        storage = db._tree._physical_obj
+        single_reads = []
+        read = storage.read
+        storage.read = lambda address: single_reads.append(address) or read(address)
+        assert [key for key, _ in db.items()] == keys
+        # only the root is read on its own
+        assert len(single_reads) <= 1
+
+
+def test_scan_sees_uncommitted_writes(populated):
+    dbname, keys = populated
+    with connect(dbname) as db:
+        db['00000'] = 'changed'
+        del db['00001']
+        items = dict(db.items(None, '00003', readahead=16))
+        assert items == {'00000': 'changed', '00002': '20000'}
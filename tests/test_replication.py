@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import pytest
+
+from interface import connect
+from replication import backup, replicate, follow
+from exception import ReplicationError
+
+
+@pytest.fixture
+def source(dbname):
+    with connect(dbname) as db:
+        db.update(('%03d' % i, str(i)) for i in range(100))
+        db.commit()
+    return dbname
+
+
+def contents(name):
+    with connect(name) as db:
+        return dict(db.items())
+
+
+def test_full_and_incremental_backup(source, tmp_path):
+    target = str(tmp_path / 'backup.db')
+    assert backup(source, target) == os.path.getsize(source) - 4096
+    assert contents(target) == contents(source)
+    assert backup(source, target, incremental=True) == 0
+    with connect(source) as db:
+        db['new'] = 'n'
+        db.commit()
+    size = os.path.getsize(target)
+    shipped = backup(source, target, incremental=True)
+    assert shipped == os.path.getsize(source) - size
+    assert contents(target)['new'] == 'n'
+
+
+def test_follow_keeps_readers_current(source, tmp_path):
+    replica = str(tmp_path / 'replica.db')
+    follow(source, replica, interval=0, rounds=1)
+    reader = connect(replica)
+    with connect(source) as db:
+        del db['000']
+        db.commit()
+    follow(source, replica, interval=0, rounds=1)
+    assert '000' not in reader
+    assert len(reader) == 99
+    reader.close()
+
+
+def test_diverged_replica_is_refused(source, tmp_path):
+    replica = str(tmp_path / 'replica.db')
+    replicate(source, replica)
+    with connect(replica) as db:
+        db['local'] = 'write'
+        db.commit()
+    with pytest.raises(ReplicationError):
+        replicate(source, replica)
+
+
+def test_hot_backup_is_not_blocked_by_a_writer(source, tmp_path):
+    writer = connect(source)
+    writer['pending'] = 'p'
+    copy = threading.Thread(target=backup, args=(source, str(tmp_path / 'backup.db')))
+    copy.start()
+    copy.join(10)
+    blocked = copy.is_alive()
+    writer.commit()
+    writer.close()
+    copy.join()
+    assert not blocked
+    assert 'pending' not in contents(str(tmp_path / 'backup.db'))
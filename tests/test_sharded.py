@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import pytest
+
+from interface import connect
+from sharded import connect_sharded, ShardedDBDB
+from exception import ShardConfigError
+
+
+@pytest.mark.parametrize('options', [{'shards': 3}, {'partition': 'range', 'boundaries': ['c', 'm']}])
+def test_merged_order_and_reopen(tmp_path, options):
+    directory = str(tmp_path / 'shards')
+    expected = dict(('%s%02d' % (letter, i), str(i)) for letter in 'abnz' for i in range(20))
+    with connect_sharded(directory, **options) as db:
+        for key, value in expected.items():
+            db[key] = value
+        del db['a00']
+        del expected['a00']
+        db.commit()
+    with connect_sharded(directory, **options) as db:
+        assert list(db.items()) == sorted(expected.items())
+        assert list(db.keys('b', 'o')) == sorted(key for key in expected if 'b' <= key < 'o')
+        assert len(db) == len(expected)
+        assert db['n05'] == '5'
+
+
+def test_layout_mismatch_is_refused(tmp_path):
+    directory = str(tmp_path / 'shards')
+    connect_sharded(directory, shards=2).close()
+    with pytest.raises(ShardConfigError):
+        connect_sharded(directory, shards=3)
+
+
+def test_failed_delete_does_not_keep_the_shard_locked(tmp_path):
+    directory = str(tmp_path / 'shards')
+    db = connect_sharded(directory, shards=2)
+    db['a'] = '1'
+    db.commit()
+    with pytest.raises(KeyError):
+        del db['missing']
+    db.commit()
+
+    # another handle on every shard must get the lock now
+    def write_all():
+        for i in range(2):
+            other = connect(os.path.join(directory, ShardedDBDB.SHARD_NAME_FORMAT % i))
+            other['b'] = '2'
+            other.commit()
+            other.close()
+    writer = threading.Thread(target=write_all)
+    writer.start()
+    writer.join(10)
+    blocked = writer.is_alive()
+    db.close()
+    writer.join()
+    assert not blocked
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from interface import connect
+from exception import ExpiryError
+
+TTL = 0.05
+
+
+def expire():
+    time.sleep(TTL * 2)
+
+
+@pytest.mark.parametrize('options', [{}, {'optimistic': True}, {'cache_limit': 5}])
+def test_expired_keys_read_as_missing(dbname, options):
+    db = connect(dbname, **options)
+    db.update(('%02d' % i, str(i)) for i in range(10))
+    db.set('short', 's', ttl=TTL)
+    db.set('long', 'l', ttl=60)
+    db.commit()
+    assert db['short'] == 's'
+    assert len(db) == 12
+    expire()
+    assert 'short' not in db
+    assert 'short' not in list(db.keys())
+    assert len(db) == 11
+    assert db['long'] == 'l'
+    db.close()
+
+
+def test_purge_deletes_only_expired_keys(dbname):
+    db = connect(dbname)
+    db.set('a', '1', ttl=TTL)
+    db.set('b', '2', ttl=TTL)
+    db.set('c', '3', ttl=60)
+    db['d'] = '4'
+    db.commit()
+    expire()
+    assert db.purge_expired() == 2
+    db.commit()
+    assert db.purge_expired() == 0
+    db.close()
+    with connect(dbname) as db:
+        assert dict(db.items()) == {'c': '3', 'd': '4'}
+        assert len(db) == 2
+
+
+def test_rewrite_without_ttl_keeps_the_key(dbname):
+    db = connect(dbname)
+    db.set('a', '1', ttl=TTL)
+    db.commit()
+    db['a'] = 'forever'
+    db.commit()
+    expire()
+    assert db.purge_expired() == 0
+    assert db['a'] == 'forever'
+    db.close()
+
+
+def test_expired_key_can_be_written_again(dbname):
+    with connect(dbname) as db:
+        db.set('a', '1', ttl=TTL)
+        db.commit()
+        expire()
+        assert len(db) == 0
+        db['a'] = '2'
+        assert len(db) == 1
+        db.commit()
+        assert db['a'] == '2'
+
+
+def test_ttl_refused_in_delta_log_mode(dbname):
+    with connect(dbname, delta_log=True) as db:
+        with pytest.raises(ExpiryError):
+            db.set('a', '1', ttl=1)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import array
+
+import pytest
+
+from interface import connect
+from exception import ValueCodecError
+
+VALUES = {
+    'utf8': u'héllo',
+    'bytes': b'\x00\xffraw',
+    'marshal': {'a': [1, 2.5, None], 'b': (1, 2)},
+    'json': {'a': [1, 2.5, None], 'b': 'text'},
+    'pickle': {'set': {1, 2}, 'buffer': bytearray(b'x' * 1000)},
+    'array': array.array('d', [1.5, -2.0, 3.25]),
+}
+
+
+@pytest.mark.parametrize('codec', sorted(VALUES))
+def test_round_trip_through_the_file(dbname, codec):
+    with connect(dbname, value_codec=codec) as db:
+        db['k'] = VALUES[codec]
+        assert db['k'] == VALUES[codec]
+        db.commit()
+    # the codec is recorded in the superblock
+    with connect(dbname) as db:
+        assert db['k'] == VALUES[codec]
+
+
+def test_codec_mismatch_is_refused(dbname):
+    with connect(dbname, value_codec='json') as db:
+        db['k'] = [1]
+        db.commit()
+    with pytest.raises(ValueCodecError):
+        connect(dbname, value_codec='pickle')
+
+
+def test_unknown_codec(dbname):
+    with pytest.raises(ValueCodecError):
+        connect(dbname, value_codec='yaml')
+
+
+@pytest.mark.parametrize('options', [{}, {'delta_log': True}, {'optimistic': True}, {'cache_limit': 1}])
+def test_array_values_read_back_as_arrays(dbname, options):
+    with connect(dbname, value_codec='array', **options) as db:
+        db['k'] = [1.0, 2.0]
+        assert db['k'] == array.array('d', [1.0, 2.0])
+        db.commit()
+        assert db['k'] == array.array('d', [1.0, 2.0])